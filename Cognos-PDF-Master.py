@@ -1,26 +1,52 @@
 import streamlit as st
 import io
+import re
+import sys
+import glob
+import json
+import time
+import argparse
+import uuid
+import random
+import platform
+import statistics
+import tracemalloc
+import multiprocessing
 import zipfile
 import os 
 import tempfile 
+import shutil
+import hashlib
+import threading
+import functools
+import inspect
+import itertools
+import mmap
+import pickle
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import List
 import fitz  # PyMuPDF
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
+from PIL import Image, ImageOps
+try:
+    import resource  # Indisponível no Windows: o benchmark omite o pico de RSS
+except ImportError:
+    resource = None
+from xml.sax.saxutils import escape
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, TableStyle
+from reportlab.platypus import Image as RLImage
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.pagesizes import A4
+from reportlab.lib import colors
 from docx import Document
+from docx.table import Table as DocxTable
+from docx.text.hyperlink import Hyperlink
 from pdf2docx import Converter # ### NOVO: Necessário pip install pdf2docx
 
 # --- Configuração da Página e CSS ---
-st.set_page_config(
-    page_title="Cognos PDF Master",
-    page_icon="👁️",
-    layout="wide",
-    initial_sidebar_state="collapsed"
-)
-
 # CSS aprimorado
-st.markdown("""
+PAGE_CSS = """
 <style>
     .card {
         background-color: #ffffff;
@@ -58,201 +84,2220 @@ st.markdown("""
         margin-bottom: 20px;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+def setup_page():
+    """Configura a página do Streamlit; chamada só pela interface, não pelo CLI nem pelos workers."""
+    st.set_page_config(
+        page_title="Cognos PDF Master",
+        page_icon="👁️",
+        layout="wide",
+        initial_sidebar_state="collapsed"
+    )
+    st.markdown(PAGE_CSS, unsafe_allow_html=True)
+
+# --- Cache de Previews ---
+@st.cache_resource
+def get_render_lock() -> threading.RLock:
+    """Lock único do processo para o fitz, que não é thread-safe.
+
+    Toda renderização feita no servidor (previews, miniaturas e a prévia da assinatura, inclusive a
+    thread de pré-carregamento) passa por ele. Fica no cache_resource porque o Streamlit reexecuta o
+    script num módulo novo a cada rerun: uma variável global criaria um lock diferente por execução.
+    """
+    return threading.RLock()
+
+class PreviewCache:
+    """Cache LRU de previews indexado pela identidade do conteúdo (source_key) + página + DPI, limitado por bytes."""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_entries: int = 256):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def digest(data) -> str:
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    def __contains__(self, key) -> bool:
+        # Consulta sem afetar a ordem LRU nem as estatísticas de acerto
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, img_data: bytes, page_count: int):
+        size = len(img_data)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[0])
+            self._entries[key] = (img_data, page_count)
+            self._size += size
+            # Remove os menos usados até respeitar o orçamento de bytes e de entradas
+            while self._size > self.max_bytes or len(self._entries) > self.max_entries:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+@st.cache_resource
+def get_preview_cache() -> PreviewCache:
+    """Instância única do cache, preservada entre os reruns do Streamlit."""
+    return PreviewCache()
+
+# --- Entrada/Saída de Documentos ---
+def pdf_source(file):
+    """Normaliza a origem do PDF sem copiar: caminho, memoryview (upload/mmap) ou bytes."""
+    if isinstance(file, (str, os.PathLike)):
+        return os.fspath(file)
+    if isinstance(file, (bytes, memoryview)):
+        return file
+    if isinstance(file, (bytearray, mmap.mmap)):
+        return memoryview(file)
+    if hasattr(file, 'getbuffer'):  # BytesIO / UploadedFile do Streamlit
+        return file.getbuffer()
+    name = getattr(file, 'name', None)
+    if isinstance(name, str) and os.path.isfile(name):  # Arquivo aberto a partir do disco
+        return name
+    if hasattr(file, 'fileno') and not isinstance(file, tempfile.SpooledTemporaryFile):
+        # Handle de disco sem caminho utilizável (ex.: TemporaryFile, descritor herdado): mapeia em vez de ler
+        try:
+            return memoryview(mmap_file(file))
+        except (OSError, ValueError):
+            pass  # Pipe, socket ou arquivo vazio: não mapeável
+    data = file.read()
+    if getattr(file, 'seekable', lambda: hasattr(file, 'seek'))(): file.seek(0)
+    return data
+
+def open_pdf(file) -> fitz.Document:
+    """Abre o PDF direto do caminho (MuPDF lê do disco) ou do buffer em memória, sem cópias extras."""
+    src = pdf_source(file)
+    if isinstance(src, str):
+        return fitz.open(src)
+    return fitz.open(stream=src, filetype="pdf")
+
+def mmap_file(file) -> mmap.mmap:
+    """Mapeia um arquivo em memória (somente leitura), a partir do caminho ou de um handle já aberto."""
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "rb") as fh:
+            return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(file, 'writable') and file.writable():
+        file.flush()  # Dados ainda no buffer do handle não estariam no mapeamento
+    return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+def shareable_source(file):
+    """Origem serializável para workers: o caminho quando existir, senão uma única cópia em bytes."""
+    src = pdf_source(file)
+    return src if isinstance(src, (str, bytes)) else bytes(src)
+
+def source_digest(src) -> str:
+    """Hash do conteúdo de uma origem de pdf_source; arquivos em disco são lidos via mmap."""
+    if isinstance(src, str):
+        with mmap_file(src) as mm:
+            return PreviewCache.digest(mm)
+    return PreviewCache.digest(src)
+
+def source_key(file) -> str:
+    """Identidade do conteúdo para os caches. Uploads do Streamlit têm file_id próprio (novo a cada
+    envio), então não são lidos a cada rerun; só caminhos e bytes são hasheados."""
+    file_id = getattr(file, "file_id", None)
+    if isinstance(file_id, str):
+        return f"upload:{file_id}:{file.size}"
+    return source_digest(pdf_source(file))
+
+def save_pdf(doc: fitz.Document, out=None, **save_opts):
+    """Salva direto em `out` (caminho ou handle de arquivo); sem `out`, devolve os bytes."""
+    if out is None:
+        return doc.tobytes(**save_opts)
+    doc.save(out, **save_opts)
+    return out
+
+def save_incremental(file, edit, out=None):
+    """Aplica `edit(doc)` e anexa só os objetos alterados ao final do arquivo original (atualização incremental).
+
+    O original é copiado byte a byte (sem reserializar) para o destino, o que preserva assinaturas
+    digitais e a estrutura existentes. Se o documento não aceitar salvamento incremental
+    (ex.: precisou de reparo), faz a gravação completa.
+    """
+    src = pdf_source(file)
+    target = out if isinstance(out, (str, os.PathLike)) else None
+    if target is None:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
+            work_path = tmp.name
+    else:
+        work_path = os.fspath(target)
+    try:
+        if isinstance(src, str):
+            shutil.copyfile(src, work_path)
+        else:
+            with open(work_path, "wb") as fh:
+                fh.write(src)
+        full_bytes = None
+        with fitz.open(work_path) as doc:
+            edit(doc)
+            if doc.can_save_incrementally():
+                doc.saveIncr()
+            else:
+                full_bytes = doc.tobytes()
+        if full_bytes is not None:
+            with open(work_path, "wb") as fh:
+                fh.write(full_bytes)
+        if target is not None:
+            return out
+        if out is None:
+            with open(work_path, "rb") as fh:
+                return fh.read()
+        with open(work_path, "rb") as fh:
+            shutil.copyfileobj(fh, out)
+        return out
+    finally:
+        if target is None and os.path.exists(work_path):
+            os.remove(work_path)
+
+def written_size(result, out=None) -> int:
+    """Tamanho da saída gerada: bytes devolvidos, caminho ou handle de arquivo."""
+    if out is None:
+        return len(result)
+    if isinstance(out, (str, os.PathLike)):
+        return os.path.getsize(out)
+    name = getattr(out, 'name', None)
+    if isinstance(name, str) and os.path.isfile(name):  # PyMuPDF grava direto no caminho do handle
+        return os.path.getsize(name)
+    return out.tell()
+
+# --- Execução Paralela ---
+# Estado por processo worker (ex.: bytes do PDF enviados uma única vez pelo initializer)
+_WORKER_STATE = {}
+
+IMAGE_FORMATS = {"jpg": "jpg", "jpeg": "jpg", "png": "png", "webp": "webp"}
+TEXT_FORMATS = {"txt": "text/plain", "json": "application/json", "ndjson": "application/x-ndjson"}
+
+# merge_pdfs, iter_text e pdf_to_docx só abrem processos quando `workers` é informado: o ponto em que
+# o pool compensa depende do documento e da máquina, então meça com `bench -w N` antes de ativar
+def default_workers() -> int:
+    return max(1, os.cpu_count() or 1)
+
+def _init_worker(source):
+    _WORKER_STATE.clear()
+    _WORKER_STATE["source"] = source
+
+def _worker_doc() -> fitz.Document:
+    """Documento aberto uma única vez por worker e reaproveitado entre as tarefas."""
+    if "doc" not in _WORKER_STATE:
+        _WORKER_STATE["doc"] = open_pdf(_WORKER_STATE["source"])
+    return _WORKER_STATE["doc"]
+
+def page_chunks(page_count: int, workers: int, per_worker: int = 4, max_size: int = None) -> List[tuple]:
+    """Divide as páginas em faixas contíguas [início, fim) para balancear a carga entre os workers."""
+    size = max(1, -(-page_count // (workers * per_worker)))
+    if max_size:
+        size = min(size, max_size)
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+def iter_bounded(executor, func, tasks, window: int):
+    """Submete func(tarefa) ao executor com no máximo `window` tarefas em voo e devolve os resultados em ordem.
+
+    Se o consumidor parar antes do fim (erro/cancelamento), o que ainda não começou é descartado.
+    """
+    remaining = iter(tasks)
+    pending = deque(executor.submit(func, t) for t in itertools.islice(remaining, window))
+    try:
+        while pending:
+            result = pending.popleft().result()
+            for t in itertools.islice(remaining, 1):
+                pending.append(executor.submit(func, t))
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+
+def iter_parallel(func, tasks: List, workers: int = None, initializer=None, initargs=()):
+    """Executa func sobre as tarefas num pool de processos e devolve os resultados em ordem.
+
+    Mantém no máximo 2 tarefas por worker em voo, para limitar a memória dos resultados pendentes.
+    Se o pool não puder ser usado (ex.: função não serializável), executa sequencialmente.
+    """
+    tasks = list(tasks)
+    workers = min(workers or default_workers(), len(tasks))
+    if workers > 1:
+        done = 0
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+                results = iter_bounded(pool, func, tasks, workers * 2)
+                try:
+                    for result in results:
+                        done += 1
+                        yield result
+                finally:
+                    results.close()  # Cancela o pendente antes de o pool esperar por ele ao fechar
+            return
+        except (BrokenProcessPool, pickle.PicklingError, OSError):
+            if done:
+                raise
+    if initializer:
+        initializer(*initargs)
+    try:
+        for t in tasks:
+            yield func(t)
+    finally:
+        if initializer:
+            _WORKER_STATE.clear()
+
+def encode_pixmap(pix, fmt: str = "jpg", quality: int = 95) -> bytes:
+    """Serializa um Pixmap em JPEG/PNG/WebP."""
+    fmt = IMAGE_FORMATS.get(fmt.lower())
+    if fmt is None:
+        raise ValueError("Formato de imagem não suportado.")
+    if fmt == "webp":
+        return pix.pil_tobytes(format="WEBP", quality=quality)  # Necessário pip install pillow
+    if fmt == "jpg":
+        return pix.tobytes("jpg", jpg_quality=quality)
+    return pix.tobytes("png")
+
+def _render_pages_task(task) -> List[tuple]:
+    """Worker: renderiza uma faixa de páginas a partir da origem compartilhada do PDF."""
+    start, end, dpi, fmt, quality = task
+    doc = _worker_doc()
+    return [(i, encode_pixmap(doc[i].get_pixmap(dpi=dpi), fmt, quality)) for i in range(start, end)]
+
+def _extract_text_task(task) -> List[tuple]:
+    """Worker: extrai texto puro ou blocos com bounding boxes de uma faixa de páginas."""
+    start, end, structured = task
+    doc = _worker_doc()
+    pages = []
+    for i in range(start, end):
+        page = doc[i]
+        if not structured:
+            pages.append((i, page.get_text()))
+            continue
+        blocks = [{"bbox": [round(v, 2) for v in b[:4]], "text": b[4]}
+                  for b in page.get_text("blocks") if b[6] == 0]
+        pages.append((i, {"page": i + 1, "width": page.rect.width, "height": page.rect.height, "blocks": blocks}))
+    return pages
+
+# --- Divisão ---
+def compile_page_ranges(ranges: str, page_count: int) -> List[tuple]:
+    """Compila "1-5, 8, 7" em sequências contíguas (início, fim) 0-based, ordenadas e sem repetição.
+
+    Itens inválidos são ignorados e páginas fora do documento descartadas.
+    """
+    page_numbers = set()
+    for part in ranges.split(','):
+        part = part.strip()
+        try:
+            if '-' in part:
+                start, end = map(int, part.split('-'))
+                page_numbers.update(range(max(start, 1) - 1, min(end, page_count)))
+            else:
+                page_numbers.add(int(part) - 1)
+        except ValueError:
+            continue
+    return _to_runs(sorted(p for p in page_numbers if 0 <= p < page_count))
+
+def _to_runs(pages: List[int]) -> List[tuple]:
+    runs = []
+    for page in pages:
+        if runs and runs[-1][1] == page - 1:
+            runs[-1] = (runs[-1][0], page)
+        else:
+            runs.append((page, page))
+    return runs
+
+def _page_size_estimate(doc: fitz.Document, page_num: int, seen: set) -> int:
+    """Bytes dos streams de conteúdo e das imagens da página (imagens já contadas na parte não somam)."""
+    page = doc[page_num]
+    size = sum(len(doc.xref_stream_raw(xref) or b"") for xref in page.get_contents())
+    for img in page.get_images(full=True):
+        if img[0] not in seen:
+            seen.add(img[0])
+            size += len(doc.xref_stream_raw(img[0]) or b"")
+    return size
+
+def build_split_plan(doc: fitz.Document, mode: str, value=None) -> List[tuple]:
+    """Plano de divisão: lista de (rótulo, sequências contíguas de páginas) por arquivo de saída."""
+    page_count = len(doc)
+    if mode == "every":
+        size = int(value or 1)
+        if size < 1:
+            raise ValueError("O número de páginas por parte deve ser maior que zero.")
+        return [(f"p{start + 1}-{min(start + size, page_count)}", [(start, min(start + size, page_count) - 1)])
+                for start in range(0, page_count, size)]
+    if mode == "ranges":
+        plan = []
+        for part in str(value or "").split(','):
+            runs = compile_page_ranges(part, page_count)
+            if runs:
+                plan.append((f"p{part.strip()}", runs))
+        return plan
+    if mode == "bookmarks":
+        level = int(value or 1)
+        starts = sorted({page - 1 for lvl, _, page in doc.get_toc() if lvl == level and 0 < page <= page_count})
+        if not starts:
+            raise ValueError("O documento não tem marcadores nesse nível.")
+        if starts[0] != 0:
+            starts.insert(0, 0)
+        bounds = starts + [page_count]
+        titles = {page - 1: title for lvl, title, page in reversed(doc.get_toc()) if lvl == level}
+        plan = []
+        for start, end in zip(bounds, bounds[1:]):
+            label = re.sub(r"[^\w-]+", "_", titles.get(start, "inicio")).strip("_")[:40] or "secao"
+            plan.append((label, [(start, end - 1)]))
+        return plan
+    if mode == "size":
+        budget = int(value)
+        plan, start, used, seen = [], 0, 0, set()
+        for page_num in range(page_count):
+            cost = _page_size_estimate(doc, page_num, seen)
+            if page_num > start and used + cost > budget:
+                plan.append((f"p{start + 1}-{page_num}", [(start, page_num - 1)]))
+                start, seen = page_num, set()
+                used = _page_size_estimate(doc, page_num, seen)
+            else:
+                used += cost
+        plan.append((f"p{start + 1}-{page_count}", [(start, page_count - 1)]))
+        return plan
+    raise ValueError(f"Modo de divisão desconhecido: {mode}")
+
+# --- Junção ---
+def _display_name(file, index: int) -> str:
+    name = file if isinstance(file, str) else getattr(file, 'name', None)
+    return os.path.basename(name) if isinstance(name, str) else f"arquivo_{index + 1}"
+
+def _shift_toc(entries, offset: int) -> list:
+    """Desloca as páginas do sumário; entradas sem destino (links externos, destinos não resolvidos)
+    são mantidas com página -1 para não quebrar a hierarquia dos filhos."""
+    return [[level, title, page + offset if page > 0 else -1] for level, title, page, *_ in entries]
+
+def _merge_into(target: fitz.Document, sources: List, toc: list) -> List[dict]:
+    """Acrescenta cada origem a `target` em ordem, ajustando o sumário; devolve o tempo por arquivo."""
+    timings = []
+    for index, source in enumerate(sources):
+        start = time.perf_counter()
+        with open_pdf(source) as doc:
+            if doc.needs_pass:
+                raise ValueError(f"{_display_name(source, index)} está protegido por senha.")
+            offset = len(target)
+            toc.extend(_shift_toc(doc.get_toc(), offset))
+            target.insert_pdf(doc)
+            timings.append({"páginas": len(doc), "segundos": round(time.perf_counter() - start, 4)})
+    return timings
+
+def _merge_group_task(task):
+    """Worker: junta um grupo contíguo de arquivos num PDF parcial em disco."""
+    sources, out_path = task
+    toc = []
+    with fitz.open() as partial:
+        timings = _merge_into(partial, sources, toc)
+        partial.save(out_path)
+    return out_path, timings, toc
+
+# --- PDF para Word ---
+class OperationCancelled(Exception):
+    """Operação interrompida a pedido do usuário."""
+
+def _open_converter(source) -> Converter:
+    return Converter(source) if isinstance(source, str) else Converter(stream=source)
+
+def _docx_parse_task(task):
+    """Worker: analisa um bloco de páginas com pdf2docx e serializa o resultado em JSON."""
+    start, end, json_path = task
+    cv = _open_converter(_WORKER_STATE["source"])
+    try:
+        settings = cv.default_settings
+        cv.load_pages()
+        for page in cv.pages:
+            page.skip_parsing = not (start <= page.id < end)
+        # serialize() grava o nome do arquivo de origem, que não existe quando lido de memória
+        cv.filename_pdf = cv.filename_pdf or "documento.pdf"
+        cv.parse_document(**settings).parse_pages(**settings).serialize(json_path)
+    finally:
+        cv.close()
+    return start, end, json_path
+
+# --- Imagens para PDF ---
+# Tamanhos de página em pontos; None usa o tamanho da própria imagem
+PAGE_SIZES = {"original": None, "a4": fitz.paper_size("a4"), "letter": fitz.paper_size("letter")}
+FIT_MODES = ("contain", "cover", "stretch")
+
+def _image_bytes(image_file) -> bytes:
+    if isinstance(image_file, (str, os.PathLike)):
+        with open(image_file, "rb") as f:
+            return f.read()
+    data = image_file.read()
+    image_file.seek(0)
+    return data
+
+def _prepare_image(task):
+    """Thread: corrige a rotação EXIF e reduz a imagem se preciso.
+
+    Retorna (bytes, largura_px, altura_px, dpi). JPEG/PNG que já estão prontos seguem sem
+    recodificação; o restante vira JPEG (ou PNG, se houver transparência).
+    """
+    image_file, max_side = task
+    data = _image_bytes(image_file)
+    with Image.open(io.BytesIO(data)) as img:
+        dpi = (img.info.get("dpi") or (96, 96))[0] or 96
+        orientation = img.getexif().get(0x0112, 1)
+        scale = min(1.0, max_side / max(img.size)) if max_side else 1.0
+        if scale == 1.0 and orientation == 1 and img.format in ("JPEG", "PNG"):
+            return data, img.width, img.height, dpi
+        if scale < 1.0:
+            size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+            img.draft("RGB", size)  # JPEG: decodifica já reduzido pelo DCT, sem carregar o original inteiro
+        else:
+            size = img.size
+        img = ImageOps.exif_transpose(img)
+        if orientation in (5, 6, 7, 8):
+            size = size[::-1]
+        if img.size != size:
+            img = img.resize(size, Image.LANCZOS)
+        # A escala em DPI acompanha a redução para manter o tamanho físico da página
+        dpi *= scale
+        has_alpha = img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+        buffer = io.BytesIO()
+        if has_alpha:
+            img.save(buffer, "PNG", optimize=False)
+        else:
+            img.convert("L" if img.mode in ("1", "L") else "RGB").save(buffer, "JPEG", quality=90)
+        return buffer.getvalue(), img.width, img.height, dpi
+
+def iter_prepared_images(image_files, max_side=None, workers=None):
+    """Prepara as imagens numa pool de threads, na ordem, com no máximo 2×workers em memória."""
+    workers = workers or min(8, (os.cpu_count() or 1) + 2)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        yield from iter_bounded(pool, _prepare_image, ((f, max_side) for f in image_files), workers * 2)
+
+def _image_placement(page_rect, width, height, fit, margin):
+    """Calcula o retângulo da imagem na página conforme o modo de encaixe."""
+    box = page_rect + (margin, margin, -margin, -margin)
+    if fit == "stretch":
+        return box, False
+    ratio = (min if fit == "contain" else max)(box.width / width, box.height / height)
+    w, h = width * ratio, height * ratio
+    x0, y0 = box.x0 + (box.width - w) / 2, box.y0 + (box.height - h) / 2
+    return fitz.Rect(x0, y0, x0 + w, y0 + h), True
+
+# --- Office para PDF ---
+class FlowableStream(list):
+    """Lista que o ReportLab consome pela frente, reabastecida sob demanda a partir de um gerador.
+
+    `DocTemplate.build` consulta `len()` a cada flowable e remove o primeiro item; assim só uma
+    janela pequena do documento existe em memória, e o `del lista[0]` não custa O(n) do documento inteiro.
+    """
+    def __init__(self, flowables, window: int = 64):
+        super().__init__()
+        self._source = iter(flowables)
+        self._window = window
+
+    def __len__(self):
+        if super().__len__() < self._window:
+            self.extend(itertools.islice(self._source, self._window))
+        return super().__len__()
+
+@functools.lru_cache(maxsize=None)
+def _office_styles():
+    """Estilos criados uma vez por processo e reaproveitados em todas as conversões."""
+    base = getSampleStyleSheet()
+    body = ParagraphStyle("Corpo", parent=base["Normal"], spaceAfter=10)
+    return {
+        "body": body,
+        "bullet": ParagraphStyle("Lista", parent=body, leftIndent=18, bulletIndent=6, spaceAfter=4),
+        "cell": ParagraphStyle("Celula", parent=base["Normal"], fontSize=9, leading=11),
+        "Title": base["Title"],
+        "Heading1": base["Heading1"],
+        "Heading2": base["Heading2"],
+        "Heading3": base["Heading3"],
+        "table": TableStyle([
+            ("GRID", (0, 0), (-1, -1), 0.5, colors.grey),
+            ("BACKGROUND", (0, 0), (-1, 0), colors.whitesmoke),
+            ("VALIGN", (0, 0), (-1, -1), "TOP"),
+        ]),
+    }
+
+def _iter_text_lines(file):
+    """Lê o TXT linha a linha, sem carregar o arquivo inteiro."""
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, encoding="utf-8", errors="replace") as f:
+            yield from f
+        return
+    reader = io.TextIOWrapper(file, encoding="utf-8", errors="replace")
+    try:
+        yield from reader
+    finally:
+        reader.detach()  # Não fecha o arquivo de quem chamou
+
+def _iter_txt_flowables(file):
+    styles = _office_styles()
+    for line in _iter_text_lines(file):
+        if line.strip():
+            yield Paragraph(escape(line.rstrip("\r\n")), styles["body"])
+
+def _docx_style(paragraph) -> str:
+    name = paragraph.style.name if paragraph.style is not None else ""
+    if name == "Title":
+        return "Title"
+    if name.startswith("Heading"):
+        level = name.rsplit(" ", 1)[-1]
+        return f"Heading{min(int(level), 3)}" if level.isdigit() else "Heading1"
+    if name.startswith("List"):
+        return "bullet"
+    return "body"
+
+def _docx_run_markup(run) -> str:
+    text = escape(run.text)
+    if not text:
+        return ""
+    if run.bold: text = f"<b>{text}</b>"
+    if run.italic: text = f"<i>{text}</i>"
+    if run.underline: text = f"<u>{text}</u>"
+    return text
+
+def _docx_markup(paragraph) -> str:
+    """Converte o parágrafo para a marcação do ReportLab (negrito, itálico, sublinhado e links).
+
+    Percorre o conteúdo interno, e não só `paragraph.runs`, para não perder o texto dos hyperlinks.
+    """
+    parts = []
+    for item in paragraph.iter_inner_content():
+        if isinstance(item, Hyperlink):
+            text = "".join(_docx_run_markup(run) for run in item.runs)
+            if text and item.url:
+                text = f'<link href="{escape(item.url, {chr(34): "&quot;"})}">{text}</link>'
+            parts.append(text)
+        else:
+            parts.append(_docx_run_markup(item))
+    return "".join(parts)
+
+def _docx_images(paragraph, doc, max_width):
+    """Imagens embutidas no parágrafo, reduzidas para caber na largura da página."""
+    for rid in paragraph._p.xpath(".//a:blip/@r:embed"):
+        part = doc.part.related_parts.get(rid)
+        if part is None:
+            continue
+        try:
+            with Image.open(io.BytesIO(part.blob)) as img:
+                img.load()  # EMF/WMF abrem o cabeçalho mas não decodificam; SVG nem abre
+                width, height = img.width * 0.75, img.height * 0.75  # 96 DPI -> pontos
+        except (OSError, ValueError):
+            continue  # Formato que o ReportLab não desenha: mantém o texto e pula a imagem
+        scale = min(1.0, max_width / width)
+        yield RLImage(io.BytesIO(part.blob), width=width * scale, height=height * scale)
+
+def _docx_table(table, max_width):
+    styles = _office_styles()
+    rows = [[Paragraph(escape(cell.text), styles["cell"]) for cell in row.cells] for row in table.rows]
+    columns = max((len(r) for r in rows), default=0)
+    if not columns:
+        return None
+    rows = [r + [""] * (columns - len(r)) for r in rows]
+    return Table(rows, colWidths=[max_width / columns] * columns, repeatRows=1, style=styles["table"])
+
+def _iter_docx_flowables(file, max_width):
+    """Percorre o corpo do DOCX na ordem original: títulos, parágrafos, listas, tabelas e imagens."""
+    styles = _office_styles()
+    doc = Document(file)
+    for block in doc.iter_inner_content():
+        if isinstance(block, DocxTable):
+            table = _docx_table(block, max_width)
+            if table is not None:
+                yield table
+            continue
+        markup = _docx_markup(block)
+        style = _docx_style(block)
+        if markup.strip():
+            yield Paragraph(markup, styles[style], bulletText="•" if style == "bullet" else None)
+        yield from _docx_images(block, doc, max_width)
+
+# --- Compressão ---
+# dpi: resolução alvo das imagens; quality: qualidade JPEG da recompressão
+COMPRESSION_PRESETS = {
+    "screen": {"dpi": 72, "quality": 50},
+    "ebook": {"dpi": 150, "quality": 70},
+    "print": {"dpi": 300, "quality": 85},
+}
+
+# Opções de salvamento da etapa final de compressão
+COMPRESSED_SAVE_OPTIONS = {"garbage": 4, "deflate": True, "deflate_images": True, "deflate_fonts": True, "use_objstms": 1}
+
+# Só reamostra imagens que encolhem mais que isso; perto da resolução alvo, recodificar só perde qualidade
+MIN_DOWNSCALE = 0.95
+
+def _recompress_image(doc: fitz.Document, xref: int, width: int, height: int, quality: int, raw_size: int):
+    """Reamostra uma imagem para o tamanho alvo e a recodifica em JPEG.
+
+    Devolve (xref, jpeg, largura, altura, colorspace) ou None quando não houver ganho.
+    """
+    pix = fitz.Pixmap(doc, xref)
+    if pix.alpha:
+        return None
+    if pix.colorspace is None or pix.colorspace.n not in (1, 3):
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    mode = "L" if pix.n == 1 else "RGB"
+    img = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+    if (width, height) != img.size:
+        img = img.resize((width, height), Image.LANCZOS)
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality=quality, optimize=True)
+    data = buffer.getvalue()
+    if len(data) >= raw_size:
+        return None
+    return xref, data, width, height, "/DeviceGray" if mode == "L" else "/DeviceRGB"
+
+def _recompress_image_task(task):
+    """Worker: `_recompress_image` sobre o documento do worker."""
+    return _recompress_image(_worker_doc(), *task)
+
+def _apply_recompressed(doc: fitz.Document, result) -> int:
+    """Substitui o stream da imagem pelo JPEG recomprimido; devolve os bytes economizados."""
+    xref, data, width, height, colorspace = result
+    saved = len(doc.xref_stream_raw(xref)) - len(data)
+    doc.update_stream(xref, data, compress=0)
+    for key in ("DecodeParms", "Decode"):
+        doc.xref_set_key(xref, key, "null")
+    doc.xref_set_key(xref, "Filter", "/DCTDecode")
+    doc.xref_set_key(xref, "Width", str(width))
+    doc.xref_set_key(xref, "Height", str(height))
+    doc.xref_set_key(xref, "ColorSpace", colorspace)
+    doc.xref_set_key(xref, "BitsPerComponent", "8")
+    return saved
+
+def _image_targets(doc: fitz.Document, dpi: int) -> dict:
+    """Tamanho alvo (em pixels) de cada imagem acima de `dpi`, considerando a maior área onde aparece."""
+    placed = {}
+    for page in doc:
+        for info in page.get_image_info(xrefs=True):
+            xref = info.get("xref")
+            if not xref:
+                continue
+            bbox = fitz.Rect(info["bbox"])
+            w, h = placed.get(xref, (0, 0))
+            placed[xref] = (max(w, bbox.width), max(h, bbox.height))
+
+    targets = {}
+    for xref, (box_w, box_h) in placed.items():
+        if doc.xref_get_key(xref, "SMask")[0] != "null" or doc.xref_get_key(xref, "BitsPerComponent")[1] == "1":
+            continue  # Transparência e imagens bitonais (fax/JBIG2) não vão bem para JPEG
+        width = int(doc.xref_get_key(xref, "Width")[1])
+        height = int(doc.xref_get_key(xref, "Height")[1])
+        if box_w <= 0 or box_h <= 0:
+            continue
+        scale = min(1.0, dpi / (width / (box_w / 72)), dpi / (height / (box_h / 72)))
+        if scale >= MIN_DOWNSCALE:
+            continue
+        targets[xref] = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return targets
+
+def _font_file_bytes(doc: fitz.Document) -> int:
+    """Soma dos streams de fontes embutidas (FontFile/FontFile2/FontFile3)."""
+    total = 0
+    for xref in range(1, doc.xref_length()):
+        if doc.xref_get_key(xref, "Type")[1] != "/FontDescriptor":
+            continue
+        for key in ("FontFile", "FontFile2", "FontFile3"):
+            kind, value = doc.xref_get_key(xref, key)
+            if kind == "xref":
+                total += len(doc.xref_stream_raw(int(value.split()[0])) or b"")
+    return total
+
+# --- Instrumentação ---
+class JsonlMetricsSink:
+    """Grava cada medição como uma linha JSON (append por registro: seguro entre processos)."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __call__(self, record: dict):
+        with open(self.path, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+class Instrumentation:
+    """Mede cada chamada do PDFEngine (tempo, CPU, RSS, bytes, páginas) e agrega por operação.
+
+    Sinks são callables que recebem cada registro; as últimas `max_samples` latências de cada
+    operação ficam em memória para percentis e exportação no formato de texto do Prometheus.
+    """
+
+    def __init__(self, max_samples: int = 1024, count_pages: bool = True):
+        self.max_samples = max_samples
+        self.count_pages = count_pages
+        self.sinks = []
+        self._ops = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def remove_sink(self, sink):
+        if sink in self.sinks:
+            self.sinks.remove(sink)
+
+    def wrap(self, op: str, func):
+        """Envolve `func`; chamadas aninhadas (ex.: pdf_to_jpg -> write_page_images_zip) contam só a externa.
+
+        Geradores (ex.: iter_text) são medidos ao longo de toda a iteração, somando só o tempo
+        gasto dentro do gerador, não o do consumidor entre um item e outro.
+        """
+        if inspect.isgeneratorfunction(func):
+            return self._wrap_generator(op, func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if getattr(self._local, "depth", 0):
+                return func(*args, **kwargs)
+            self._local.depth = 1
+            _CALL_PAGES.count = None
+            rss_before = _peak_rss_kb()
+            wall, cpu = time.perf_counter(), time.process_time()
+            status, error, result = "ok", None, None
+            try:
+                result = func(*args, **kwargs)
+                return result
+            except Exception as e:
+                status, error = "error", f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                self._local.depth = 0
+                wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+                self._record_call(op, args, status, error, wall, cpu, rss_before,
+                                  _measure(lambda: _output_size(result)), _page_count(result))
+
+        return wrapper
+
+    def _wrap_generator(self, op: str, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if getattr(self._local, "depth", 0):
+                yield from func(*args, **kwargs)
+                return
+            rss_before = _peak_rss_kb()
+            wall = cpu = 0.0
+            status, error, output, pages = "ok", None, 0, None
+            gen = func(*args, **kwargs)
+            try:
+                while True:
+                    # Profundidade e páginas só durante o passo do gerador, que pode alternar com outras chamadas
+                    self._local.depth = 1
+                    _CALL_PAGES.count = pages
+                    start, start_cpu = time.perf_counter(), time.process_time()
+                    try:
+                        item = next(gen)
+                    except StopIteration:
+                        return
+                    finally:
+                        wall += time.perf_counter() - start
+                        cpu += time.process_time() - start_cpu
+                        pages = _CALL_PAGES.count
+                        self._local.depth = 0
+                    # Os geradores do engine entregam (..., dados): soma o tamanho do que foi produzido
+                    if isinstance(item, tuple) and isinstance(item[-1], (str, bytes)):
+                        output += len(item[-1])
+                    yield item
+            except Exception as e:
+                status, error = "error", f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                gen.close()
+                self._record_call(op, args, status, error, wall, cpu, rss_before, output, pages)
+
+        return wrapper
+
+    def _record_call(self, op, args, status, error, wall, cpu, rss_before, output_bytes, pages):
+        rss_after = _peak_rss_kb()
+        self.record({
+            "ts": round(time.time(), 3), "op": op, "status": status, "error": error,
+            "wall_s": round(wall, 6), "cpu_s": round(cpu, 6),
+            "peak_rss_kb": rss_after,
+            "rss_growth_kb": rss_after - rss_before if rss_after is not None else None,
+            "input_bytes": _measure(lambda: _input_size(args[0] if args else None)),
+            "output_bytes": output_bytes,
+            "pages": pages if self.count_pages else None,
+        })
+
+    def record(self, record: dict, emit: bool = True):
+        """Agrega um registro; com emit=False (registros vindos de outro processo) não repassa aos sinks."""
+        with self._lock:
+            stats = self._ops.setdefault(record["op"], {
+                "count": 0, "errors": 0, "wall_sum": 0.0, "cpu_sum": 0.0, "input_bytes": 0,
+                "output_bytes": 0, "latencies": deque(maxlen=self.max_samples)})
+            stats["count"] += 1
+            stats["errors"] += record["status"] != "ok"
+            stats["wall_sum"] += record["wall_s"]
+            stats["cpu_sum"] += record["cpu_s"]
+            stats["input_bytes"] += record.get("input_bytes") or 0
+            stats["output_bytes"] += record.get("output_bytes") or 0
+            stats["latencies"].append(record["wall_s"])
+        if emit:
+            for sink in list(self.sinks):
+                try:
+                    sink(record)
+                except Exception:
+                    pass  # Métrica nunca derruba a operação
+
+    def summary(self) -> List[dict]:
+        """Uma linha por operação com contagens e percentis de latência."""
+        rows = []
+        with self._lock:
+            for op, stats in sorted(self._ops.items()):
+                latencies = sorted(stats["latencies"])
+                rows.append({
+                    "operação": op, "chamadas": stats["count"], "erros": stats["errors"],
+                    "p50_s": _percentile(latencies, 0.5), "p90_s": _percentile(latencies, 0.9),
+                    "p99_s": _percentile(latencies, 0.99), "cpu_médio_s": round(stats["cpu_sum"] / stats["count"], 4),
+                    "bytes_entrada": stats["input_bytes"], "bytes_saída": stats["output_bytes"],
+                })
+        return rows
+
+    def prometheus_text(self) -> str:
+        """Exposição no formato de texto do Prometheus."""
+        lines = [
+            "# HELP cognos_pdf_operation_seconds Latência das operações do PDFEngine.",
+            "# TYPE cognos_pdf_operation_seconds summary",
+        ]
+        counters = []
+        with self._lock:
+            for op, stats in sorted(self._ops.items()):
+                latencies = sorted(stats["latencies"])
+                for q in (0.5, 0.9, 0.99):
+                    lines.append(f'cognos_pdf_operation_seconds{{op="{op}",quantile="{q}"}} {_percentile(latencies, q)}')
+                lines.append(f'cognos_pdf_operation_seconds_sum{{op="{op}"}} {stats["wall_sum"]:.6f}')
+                lines.append(f'cognos_pdf_operation_seconds_count{{op="{op}"}} {stats["count"]}')
+                counters.append((op, stats))
+        lines += ["# HELP cognos_pdf_operation_errors_total Operações que terminaram com erro.",
+                  "# TYPE cognos_pdf_operation_errors_total counter"]
+        lines += [f'cognos_pdf_operation_errors_total{{op="{op}"}} {st_["errors"]}' for op, st_ in counters]
+        lines += ["# HELP cognos_pdf_operation_cpu_seconds_total Tempo de CPU gasto por operação.",
+                  "# TYPE cognos_pdf_operation_cpu_seconds_total counter"]
+        lines += [f'cognos_pdf_operation_cpu_seconds_total{{op="{op}"}} {st_["cpu_sum"]:.6f}' for op, st_ in counters]
+        for kind in ("input", "output"):
+            lines += [f"# HELP cognos_pdf_{kind}_bytes_total Bytes de {'entrada' if kind == 'input' else 'saída'} processados.",
+                      f"# TYPE cognos_pdf_{kind}_bytes_total counter"]
+            lines += [f'cognos_pdf_{kind}_bytes_total{{op="{op}"}} {st_[kind + "_bytes"]}' for op, st_ in counters]
+        rss = _peak_rss_kb()
+        if rss is not None:
+            lines += ["# HELP cognos_process_peak_rss_bytes Pico de memória residente do processo.",
+                      "# TYPE cognos_process_peak_rss_bytes gauge", f"cognos_process_peak_rss_bytes {rss * 1024}"]
+        return "\n".join(lines) + "\n"
+
+def _peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return round(sorted_values[min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))], 6)
+
+def _measure(func):
+    try:
+        return func()
+    except Exception:
+        return None
+
+def _input_size(arg) -> int:
+    if isinstance(arg, (list, tuple)):
+        return sum(_input_size(item) or 0 for item in arg)
+    if isinstance(getattr(arg, 'size', None), int):
+        return arg.size  # UploadedFile do Streamlit
+    src = pdf_source(arg)
+    return os.path.getsize(src) if isinstance(src, str) else len(src)
+
+def _output_size(result):
+    if result is None:
+        return None
+    if isinstance(result, tuple):  # get_preview_image: (png, total de páginas)
+        return len(result[0]) if result[0] else None
+    if isinstance(result, (bytes, bytearray, str, os.PathLike)):
+        return written_size(result, None if isinstance(result, (bytes, bytearray)) else result)
+    name = getattr(result, 'name', None)
+    if isinstance(name, str) and os.path.isfile(name):
+        result.flush()  # O que ainda está no buffer do handle também é saída da operação
+        return os.path.getsize(name)
+    position = result.tell()  # Handle em memória / arquivo temporário
+    size = result.seek(0, io.SEEK_END)
+    result.seek(position)
+    return size
+
+# Páginas informadas pela operação em andamento (nesta thread), via note_pages
+_CALL_PAGES = threading.local()
+
+def note_pages(count: int):
+    """Informa à instrumentação quantas páginas a operação processou, a partir do documento que ela
+    já abriu. Operações sobre entradas que não são PDF (imagens, DOCX, TXT) não informam."""
+    _CALL_PAGES.count = count
+
+def _page_count(result=None):
+    if isinstance(result, tuple):  # get_preview_image: (png, total de páginas)
+        return result[1]
+    return getattr(_CALL_PAGES, "count", None)
+
+def new_instrumentation(*sinks) -> Instrumentation:
+    """COGNOS_METRICS_LOG=<arquivo.jsonl> ativa o log JSONL (herdado pelos processos filhos)."""
+    instrumentation = Instrumentation()
+    if os.environ.get("COGNOS_METRICS_LOG"):
+        instrumentation.add_sink(JsonlMetricsSink(os.environ["COGNOS_METRICS_LOG"]))
+    for sink in sinks:
+        instrumentation.add_sink(sink)
+    return instrumentation
+
+@st.cache_resource(show_spinner=False)  # Chamada no import, também fora do Streamlit (CLI)
+def get_instrumentation() -> Instrumentation:
+    """Instância única do servidor."""
+    return new_instrumentation()
 
 # --- Lógica de Negócio (Service Layer) ---
 class PDFEngine:
     """Motor de processamento de PDFs utilizando PyMuPDF e ReportLab."""
 
     @staticmethod
-    def get_preview_image(file_stream, page_num=0, dpi=100) -> bytes:
+    def get_preview_image(file_stream, page_num=0, dpi=100, use_cache=True) -> bytes:
         """Gera bytes de imagem PNG de uma página específica do PDF para preview."""
         try:
-            # Verifica se é BytesIO ou arquivo aberto
-            stream_data = file_stream.read() if hasattr(file_stream, 'read') else file_stream
-            if hasattr(file_stream, 'seek'): file_stream.seek(0)
+            # Caminho, upload (memoryview, sem cópia) ou bytes
+            src = pdf_source(file_stream)
+
+            cache = get_preview_cache() if use_cache else None
+            if cache is not None:
+                key = (source_key(file_stream), page_num, dpi)
+                cached = cache.get(key)
+                if cached is not None:
+                    return cached
 
-            with fitz.open(stream=stream_data, filetype="pdf") as doc:
+            with get_render_lock(), open_pdf(src) as doc:
                 if page_num < len(doc):
                     page = doc[page_num]
                     pix = page.get_pixmap(dpi=dpi)
-                    return pix.tobytes("png"), len(doc)
-            
-            if hasattr(file_stream, 'seek'): file_stream.seek(0)
+                    img_data = pix.tobytes("png")
+                    if cache is not None:
+                        cache.put(key, img_data, len(doc))
+                    return img_data, len(doc)
         except Exception:
             return None, 0
         return None, 0
 
     @staticmethod
-    def merge_pdfs(files: List) -> bytes:
+    def merge_pdfs(files: List, out=None, workers: int = None, dedupe: bool = False, stats: list = None) -> bytes:
+        """Junta os PDFs na ordem recebida, preservando os marcadores (sumário) de cada arquivo.
+
+        Com vários workers, grupos contíguos de arquivos são abertos, validados e juntados em
+        paralelo em PDFs parciais no disco, que depois são concatenados (redução em árvore).
+        `dedupe` unifica objetos idênticos entre arquivos (fontes, imagens) ao salvar; é opcional porque
+        a busca de duplicatas do MuPDF cresce de forma quadrática com o número de objetos (400 arquivos
+        de 20 páginas: ~27 s com, ~5 s sem).
+        O tempo e as páginas de cada arquivo são registrados em `stats`.
+        """
+        stats = [] if stats is None else stats
+        names = [_display_name(f, i) for i, f in enumerate(files)]
+        workers = workers or 1
+        save_opts = {"garbage": 4} if dedupe else {}
         doc_merged = fitz.open()
-        for file in files:
-            with fitz.open(stream=file.read(), filetype="pdf") as doc:
-                doc_merged.insert_pdf(doc)
-        output_buffer = io.BytesIO()
-        doc_merged.save(output_buffer)
-        doc_merged.close()
-        return output_buffer.getvalue()
+        toc = []
+        try:
+            if workers <= 1 or len(files) < 2:
+                timings = _merge_into(doc_merged, files, toc)
+            else:
+                sources = [shareable_source(f) for f in files]
+                groups = page_chunks(len(sources), workers, per_worker=1)
+                timings = []
+                with tempfile.TemporaryDirectory(prefix="cognos-merge-") as tmp_dir:
+                    tasks = [(sources[start:end], os.path.join(tmp_dir, f"parte_{n}.pdf"))
+                             for n, (start, end) in enumerate(groups)]
+                    for part_path, part_timings, part_toc in iter_parallel(_merge_group_task, tasks, workers):
+                        offset = len(doc_merged)
+                        with fitz.open(part_path) as part:
+                            doc_merged.insert_pdf(part)
+                        os.remove(part_path)
+                        toc.extend(_shift_toc(part_toc, offset))
+                        timings.extend(part_timings)
+            if toc:
+                try:
+                    doc_merged.set_toc(toc)
+                except ValueError:
+                    # Sumário inconsistente em alguma origem: junta mesmo assim, sem marcadores
+                    doc_merged.set_toc([])
+            stats.extend(dict(arquivo=name, **timing) for name, timing in zip(names, timings))
+            note_pages(len(doc_merged))
+            return save_pdf(doc_merged, out, **save_opts)
+        finally:
+            doc_merged.close()
 
     @staticmethod
-    def split_pdf(file, ranges: str) -> bytes:
-        with fitz.open(stream=file.read(), filetype="pdf") as doc:
+    def split_pdf(file, ranges: str, out=None) -> bytes:
+        with open_pdf(file) as doc:
+            note_pages(len(doc))
+            runs = compile_page_ranges(ranges, len(doc))
+            if not runs:
+                raise ValueError("Nenhuma página válida selecionada.")
+
             doc_new = fitz.open()
-            page_numbers = set()
-            parts = ranges.split(',')
-            for part in parts:
-                part = part.strip()
-                if '-' in part:
-                    try:
-                        start, end = map(int, part.split('-'))
-                        page_numbers.update(range(start - 1, end))
-                    except ValueError:
-                        continue
-                else:
-                    try:
-                        page_numbers.add(int(part) - 1)
-                    except ValueError:
-                        continue
+            try:
+                # Uma cópia em bloco por sequência contígua, em vez de uma por página
+                for start, end in runs:
+                    doc_new.insert_pdf(doc, from_page=start, to_page=end)
+                return save_pdf(doc_new, out)
+            finally:
+                doc_new.close()
+
+    @staticmethod
+    def split_pdf_multi(file, mode: str, value=None, out=None, stats: list = None) -> bytes:
+        """Divide em vários PDFs numa única passada e grava cada parte no ZIP assim que é gerada.
 
-            sorted_pages = sorted([p for p in page_numbers if 0 <= p < len(doc)])
-            if not sorted_pages:
+        mode: "every" (a cada `value` páginas), "bookmarks" (marcadores de nível `value`, padrão 1),
+        "size" (partes de até ~`value` bytes, estimados pelos streams de cada página) ou
+        "ranges" (uma parte por item da expressão `value`, ex.: "1-5, 8, 10-12").
+        """
+        stats = [] if stats is None else stats
+        with open_pdf(file) as doc:
+            note_pages(len(doc))
+            plan = build_split_plan(doc, mode, value)
+            if not plan:
                 raise ValueError("Nenhuma página válida selecionada.")
+            zip_buffer = io.BytesIO() if out is None else out
+            width = len(str(len(plan)))
+            with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_STORED) as zf:
+                for n, (label, runs) in enumerate(plan, 1):
+                    with fitz.open() as part:
+                        for start, end in runs:
+                            part.insert_pdf(doc, from_page=start, to_page=end)
+                        data = part.tobytes(garbage=1, deflate=True)
+                    name = f"parte_{n:0{width}d}_{label}.pdf"
+                    zf.writestr(name, data)
+                    stats.append({"arquivo": name, "páginas": sum(e - s + 1 for s, e in runs), "bytes": len(data)})
+        return zip_buffer.getvalue() if out is None else out
 
-            for page_num in sorted_pages:
-                doc_new.insert_pdf(doc, from_page=page_num, to_page=page_num)
+    @staticmethod
+    def compress_pdf(file, out=None, preset: str = None, workers: int = None, stats: list = None) -> bytes:
+        """Comprime o PDF. Sem preset, só limpa e compacta; com preset (screen/ebook/print), também
+        reamostra imagens acima do DPI alvo (em paralelo), gera subconjuntos das fontes e remove
+        objetos duplicados/não usados. Cada etapa é registrada em `stats` (bytes economizados e tempo)."""
+        if preset is None:
+            with open_pdf(file) as doc:
+                note_pages(len(doc))
+                return save_pdf(doc, out, garbage=4, deflate=True)
+        if preset not in COMPRESSION_PRESETS:
+            raise ValueError(f"Preset de compressão desconhecido: {preset}")
+        config = COMPRESSION_PRESETS[preset]
+        stats = [] if stats is None else stats
+        source = shareable_source(file)
+        input_size = os.path.getsize(source) if isinstance(source, str) else len(source)
 
-            output_buffer = io.BytesIO()
-            doc_new.save(output_buffer)
-            doc_new.close()
-            return output_buffer.getvalue()
+        with open_pdf(source) as doc:
+            note_pages(len(doc))
+            # 1. Imagens: reamostragem + JPEG, em paralelo por imagem
+            start = time.perf_counter()
+            tasks = []
+            for xref, (width, height) in _image_targets(doc, config["dpi"]).items():
+                tasks.append((xref, width, height, config["quality"], len(doc.xref_stream_raw(xref))))
+            saved = 0
+            for result in iter_parallel(_recompress_image_task, tasks, workers, _init_worker, (source,)):
+                if result is not None:
+                    saved += _apply_recompressed(doc, result)
+            stats.append({"etapa": "imagens", "bytes_economizados": saved,
+                          "segundos": round(time.perf_counter() - start, 3)})
 
-    @staticmethod
-    def compress_pdf(file) -> bytes:
-        with fitz.open(stream=file.read(), filetype="pdf") as doc:
-            output_buffer = io.BytesIO()
-            doc.save(output_buffer, garbage=4, deflate=True) 
-            return output_buffer.getvalue()
+            # 2. Fontes: mantém só os glifos usados
+            start = time.perf_counter()
+            before = _font_file_bytes(doc)
+            doc.subset_fonts()
+            stats.append({"etapa": "fontes", "bytes_economizados": before - _font_file_bytes(doc),
+                          "segundos": round(time.perf_counter() - start, 3)})
+
+            # 3. Deduplicação de streams idênticos, remoção de objetos não usados e compactação
+            start = time.perf_counter()
+            expected = input_size - sum(stage["bytes_economizados"] for stage in stats)
+            result = save_pdf(doc, out, **COMPRESSED_SAVE_OPTIONS)
+            output_size = written_size(result, out)
+            stats.append({"etapa": "limpeza", "bytes_economizados": expected - output_size,
+                          "segundos": round(time.perf_counter() - start, 3)})
+            return result
 
     @staticmethod
-    def rotate_pdf(file, rotation_angle: int) -> bytes:
-        with fitz.open(stream=file.read(), filetype="pdf") as doc:
+    def rotate_pdf(file, rotation_angle: int, out=None, incremental: bool = False) -> bytes:
+        def edit(doc):
+            note_pages(len(doc))
             for page in doc:
                 page.set_rotation(rotation_angle)
-            output_buffer = io.BytesIO()
-            doc.save(output_buffer)
-            return output_buffer.getvalue()
+
+        if incremental:
+            return save_incremental(file, edit, out)
+        with open_pdf(file) as doc:
+            edit(doc)
+            return save_pdf(doc, out)
 
     @staticmethod
-    def protect_pdf(file, password: str) -> bytes:
-        with fitz.open(stream=file.read(), filetype="pdf") as doc:
-            output_buffer = io.BytesIO()
-            doc.save(output_buffer, encryption=fitz.PDF_ENCRYPT_AES_256, owner_pw=password, user_pw=password)
-            return output_buffer.getvalue()
+    def protect_pdf(file, password: str, out=None) -> bytes:
+        with open_pdf(file) as doc:
+            note_pages(len(doc))
+            return save_pdf(doc, out, encryption=fitz.PDF_ENCRYPT_AES_256, owner_pw=password, user_pw=password)
 
     @staticmethod
-    def sign_pdf(pdf_file, img_file, page_num: int, x: int, y: int, width: int) -> bytes:
-        pdf_bytes = pdf_file.read() if hasattr(pdf_file, 'read') else pdf_file
+    def sign_pdf(pdf_file, img_file, page_num: int, x: int, y: int, width: int, out=None,
+                 incremental: bool = False) -> bytes:
         img_bytes = img_file.read() if hasattr(img_file, 'read') else img_file
-        
-        if hasattr(pdf_file, 'seek'): pdf_file.seek(0)
         if hasattr(img_file, 'seek'): img_file.seek(0)
 
-        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
-            if page_num < 1 or page_num > len(doc):
-                raise ValueError("Número de página inválido.")
-            
-            page = doc[page_num - 1]
-            
-            with fitz.open(stream=img_bytes) as img_temp:
-                pix = img_temp[0].get_pixmap()
-                aspect_ratio = pix.height / pix.width
-                
-            height = width * aspect_ratio
-            rect = fitz.Rect(x, y, x + width, y + height)
-            
-            page.insert_image(rect, stream=img_bytes)
-            
-            output_buffer = io.BytesIO()
-            doc.save(output_buffer)
-            return output_buffer.getvalue()
+        def edit(doc):
+            note_pages(len(doc))
+            insert_signature(doc, img_bytes, page_num, x, y, width)
+
+        if incremental:
+            return save_incremental(pdf_file, edit, out)
+        with open_pdf(pdf_file) as doc:
+            edit(doc)
+            return save_pdf(doc, out)
 
     @staticmethod
-    def extract_text(file) -> bytes:
-        text_out = ""
-        with fitz.open(stream=file.read(), filetype="pdf") as doc:
-            for page in doc:
-                text_out += page.get_text() + "\n\n"
-        return text_out.encode('utf-8')
+    def run_pipeline(file, steps: List[tuple], out=None, stats: list = None) -> bytes:
+        """Aplica uma sequência de operações [(nome, parâmetros), ...] sobre um único documento aberto.
+
+        O PDF é lido uma vez e salvo uma vez, com as opções de salvamento de todas as etapas
+        combinadas (ver `merge_save_options`). O tempo de cada etapa e do salvamento vai para `stats`.
+        """
+        if not steps:
+            raise ValueError("Escolha ao menos uma operação para o pipeline.")
+        unknown = [name for name, _ in steps if name not in PIPELINE_STAGES]
+        if unknown:
+            raise ValueError(f"Operação desconhecida no pipeline: {', '.join(unknown)}")
+        stats = [] if stats is None else stats
+        options = {}
+        with open_pdf(file) as doc:
+            note_pages(len(doc))
+            for name, params in steps:
+                start = time.perf_counter()
+                merge_save_options(options, PIPELINE_STAGES[name](doc, params))
+                stats.append({"etapa": name, "segundos": round(time.perf_counter() - start, 3)})
+            start = time.perf_counter()
+            result = save_pdf(doc, out, **options)
+            stats.append({"etapa": "salvar", "segundos": round(time.perf_counter() - start, 3)})
+        return result
 
     @staticmethod
-    def pdf_to_jpg(file) -> bytes:
-        with fitz.open(stream=file.read(), filetype="pdf") as doc:
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zf:
-                for i, page in enumerate(doc):
-                    pix = page.get_pixmap(dpi=150)
-                    img_data = pix.tobytes("jpg")
-                    zf.writestr(f"pagina_{i+1}.jpg", img_data)
-            return zip_buffer.getvalue()
+    def iter_text(file, fmt: str = "txt", workers: int = None):
+        """Gera (índice da página, total de páginas, trecho formatado) em ordem, à medida que é extraído.
+
+        fmt: "txt" (texto puro), "json" (lista de páginas) ou "ndjson" (uma página por linha),
+        os dois últimos com os blocos de texto e suas bounding boxes.
+        """
+        if fmt not in TEXT_FORMATS:
+            raise ValueError("Formato de texto não suportado.")
+        source = shareable_source(file)
+        with open_pdf(source) as doc:
+            note_pages(len(doc))
+            page_count = len(doc)
+        workers = workers or 1
+        tasks = [(start, end, fmt != "txt") for start, end in page_chunks(page_count, workers, max_size=16)]
+        for pages in iter_parallel(_extract_text_task, tasks, workers, _init_worker, (source,)):
+            for i, content in pages:
+                if fmt == "txt":
+                    chunk = content + "\n\n"
+                elif fmt == "ndjson":
+                    chunk = json.dumps(content, ensure_ascii=False) + "\n"
+                else:
+                    chunk = ("[\n" if i == 0 else ",\n") + json.dumps(content, ensure_ascii=False)
+                    if i == page_count - 1:
+                        chunk += "\n]\n"
+                yield i, page_count, chunk
+
+    @staticmethod
+    def extract_text(file, fmt: str = "txt", workers: int = None, out=None, progress=None) -> bytes:
+        if out is not None:
+            for i, total, chunk in PDFEngine.iter_text(file, fmt, workers):
+                out.write(chunk.encode('utf-8'))
+                if progress: progress((i + 1) / total)
+            return out
+        return "".join(chunk for _, _, chunk in PDFEngine.iter_text(file, fmt, workers)).encode('utf-8')
 
     @staticmethod
-    def jpg_to_pdf(image_files: List) -> bytes:
+    def iter_page_images(file, dpi: int = 150, fmt: str = "jpg", quality: int = 95,
+                         workers: int = None, max_chunk: int = None, progress=None):
+        """Renderiza as páginas em paralelo (faixas por processo) e gera (índice, bytes) em ordem.
+
+        `progress`, se informado, é chamado com a fração concluída após cada página.
+        """
+        source = shareable_source(file)
+        with open_pdf(source) as doc:
+            note_pages(len(doc))
+            page_count = len(doc)
+        workers = workers or default_workers()
+        chunks = page_chunks(page_count, workers, max_size=max_chunk)
+        tasks = [(start, end, dpi, fmt, quality) for start, end in chunks]
+        for rendered in iter_parallel(_render_pages_task, tasks, workers, _init_worker, (source,)):
+            for i, img_data in rendered:
+                yield i, img_data
+                if progress: progress((i + 1) / page_count)
+
+    @staticmethod
+    def write_page_images_zip(file, out, dpi: int = 150, fmt: str = "jpg", quality: int = 95,
+                              workers: int = None, max_chunk: int = 2, progress=None):
+        """Escreve cada página no ZIP assim que é renderizada; a memória fica limitada a poucas páginas."""
+        ext = IMAGE_FORMATS.get(fmt.lower(), fmt)
+        # Imagens já são comprimidas: ZIP_STORED evita gastar CPU recomprimindo
+        with zipfile.ZipFile(out, "w", zipfile.ZIP_STORED) as zf:
+            for i, img_data in PDFEngine.iter_page_images(file, dpi, fmt, quality, workers, max_chunk, progress):
+                zf.writestr(f"pagina_{i+1}.{ext}", img_data)
+
+    @staticmethod
+    def pdf_to_jpg(file, dpi: int = 150, fmt: str = "jpg", quality: int = 95, workers: int = None) -> bytes:
+        zip_buffer = io.BytesIO()
+        PDFEngine.write_page_images_zip(file, zip_buffer, dpi, fmt, quality, workers, max_chunk=None)
+        return zip_buffer.getvalue()
+
+    @staticmethod
+    def jpg_to_pdf(image_files: List, out=None, page_size: str = "original", fit: str = "contain",
+                   margin: float = 0, max_side: int = None, workers: int = None, progress=None) -> bytes:
+        """Monta um PDF com uma imagem por página, inserindo cada imagem direto na página nova.
+
+        `page_size` é uma chave de PAGE_SIZES; com tamanho fixo a página acompanha a orientação da
+        imagem. `fit` é "contain" (inteira, centralizada), "cover" (preenche e recorta) ou "stretch".
+        `max_side` reduz imagens maiores que isso (em pixels, no lado maior) antes de inserir.
+        """
+        if page_size not in PAGE_SIZES:
+            raise ValueError(f"Tamanho de página inválido: {page_size}. Use um de: {', '.join(PAGE_SIZES)}.")
+        if fit not in FIT_MODES:
+            raise ValueError(f"Modo de encaixe inválido: {fit}. Use um de: {', '.join(FIT_MODES)}.")
+        total = len(image_files)
         doc = fitz.open()
-        for img_file in image_files:
-            img_bytes = img_file.read()
-            img_file.seek(0)
-            with fitz.open(stream=img_bytes) as img_doc:
-                pdfbytes = img_doc.convert_to_pdf()
-                with fitz.open("pdf", pdfbytes) as pdf_page:
-                    doc.insert_pdf(pdf_page)
-        output_buffer = io.BytesIO()
-        doc.save(output_buffer)
-        doc.close()
-        return output_buffer.getvalue()
+        try:
+            for i, (data, width, height, dpi) in enumerate(iter_prepared_images(image_files, max_side, workers), 1):
+                if PAGE_SIZES[page_size] is None:
+                    page = doc.new_page(width=width * 72 / dpi, height=height * 72 / dpi)
+                    page.insert_image(page.rect, stream=data)
+                else:
+                    short, long = sorted(PAGE_SIZES[page_size])
+                    page = doc.new_page(width=long, height=short) if width > height else doc.new_page(width=short, height=long)
+                    rect, keep_proportion = _image_placement(page.rect, width, height, fit, margin)
+                    # No modo "cover" o retângulo excede a página; o clip da página recorta o excesso
+                    page.insert_image(rect, stream=data, keep_proportion=keep_proportion)
+                if progress: progress(i / total)
+            return save_pdf(doc, out)
+        finally:
+            doc.close()
 
     @staticmethod
-    def office_to_pdf(file) -> bytes:
-        filename = file.name.lower()
-        text_content = []
+    def office_to_pdf(file, out=None) -> bytes:
+        """Converte DOCX (títulos, listas, tabelas e imagens) ou TXT para PDF.
+
+        O conteúdo é gerado sob demanda e consumido pelo ReportLab aos poucos (FlowableStream),
+        então logs de vários MB não viram uma lista inteira de parágrafos em memória.
+        """
+        filename = file.name.lower() if hasattr(file, "name") else str(file).lower()
+        # ReportLab aceita caminho ou handle; sem `out`, gera em memória
+        output_buffer = io.BytesIO() if out is None else out
+        doc_template = SimpleDocTemplate(output_buffer, pagesize=A4, pageCompression=1)
         if filename.endswith('.docx'):
-            doc = Document(file)
-            for para in doc.paragraphs:
-                if para.text: text_content.append(para.text)
+            story = _iter_docx_flowables(file, doc_template.width)
         elif filename.endswith('.txt'):
-            text_content = file.read().decode("utf-8").split('\n')
-
-        output_buffer = io.BytesIO()
-        doc_template = SimpleDocTemplate(output_buffer, pagesize=A4)
-        styles = getSampleStyleSheet()
-        story = [Paragraph(line, styles["Normal"]) for line in text_content if line.strip()]
-        story = [x for item in story for x in (item, Spacer(1, 10))]
-        doc_template.build(story)
-        return output_buffer.getvalue()
+            story = _iter_txt_flowables(file)
+        else:
+            raise ValueError("Formato não suportado. Envie um arquivo DOCX ou TXT.")
+        doc_template.build(FlowableStream(story))
+        return output_buffer.getvalue() if out is None else out
 
     # ### NOVO: Função para PDF -> DOCX ###
     @staticmethod
-    def pdf_to_docx(file) -> bytes:
-        """Converte PDF para DOCX usando pdf2docx com arquivos temporários."""
-        # Cria arquivos temporários pois a lib pdf2docx trabalha melhor com caminhos de arquivo
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_pdf:
-            tmp_pdf.write(file.read())
-            tmp_pdf_path = tmp_pdf.name
+    def pdf_to_docx(file, out=None, workers: int = None, progress=None, cancel=None, chunk_pages: int = 8) -> bytes:
+        """Converte PDF para DOCX usando pdf2docx, analisando as páginas em blocos.
 
-        docx_path = tmp_pdf_path.replace(".pdf", ".docx")
+        Com vários workers, cada bloco é analisado num processo e serializado em JSON num diretório
+        temporário; o JSON é removido assim que o bloco é incorporado, limitando o uso de disco.
+        `progress(fração)` é chamado a cada bloco e `cancel()` (se retornar True) interrompe a conversão.
+        """
+        with open_pdf(file) as doc:
+            note_pages(len(doc))
+            page_count = len(doc)
+        workers = workers or 1
+        chunks = page_chunks(page_count, workers, max_size=chunk_pages)
+        source = shareable_source(file) if workers > 1 else pdf_source(file)
 
+        def check_cancel():
+            if cancel and cancel():
+                raise OperationCancelled("Conversão cancelada.")
+
+        cv = _open_converter(source)
         try:
-            cv = Converter(tmp_pdf_path)
-            cv.convert(docx_path)
+            settings = cv.default_settings
+            cv.load_pages()
+            if workers <= 1:
+                # Mesmo recorte dos workers: parse_document também respeita skip_parsing
+                for start, end in chunks:
+                    check_cancel()
+                    for page in cv.pages:
+                        page.skip_parsing = not (start <= page.id < end)
+                    cv.parse_document(**settings).parse_pages(**settings)
+                    if progress: progress(0.9 * end / page_count)
+            else:
+                with tempfile.TemporaryDirectory(prefix="cognos-docx-") as tmp_dir:
+                    tasks = [(start, end, os.path.join(tmp_dir, f"paginas_{start}.json")) for start, end in chunks]
+                    for start, end, json_path in iter_parallel(_docx_parse_task, tasks, workers, _init_worker, (source,)):
+                        cv.deserialize(json_path)
+                        os.remove(json_path)
+                        if progress: progress(0.9 * end / page_count)
+                        check_cancel()
+            check_cancel()
+            # pdf2docx grava direto no caminho/handle de destino; sem `out`, em memória
+            target = io.BytesIO() if out is None else out
+            cv.make_docx(target, **settings)
+        finally:
             cv.close()
+        if progress: progress(1.0)
+        return target.getvalue() if out is None else out
+
+# --- Pipeline de Operações ---
+def insert_signature(doc: fitz.Document, img_bytes: bytes, page_num: int, x: int, y: int, width: int):
+    """Insere a imagem da assinatura na página `page_num` (1-based), mantendo a proporção."""
+    if page_num < 1 or page_num > len(doc):
+        raise ValueError("Número de página inválido.")
+    with fitz.open(stream=img_bytes) as img_temp:
+        pix = img_temp[0].get_pixmap()
+        aspect_ratio = pix.height / pix.width
+    rect = fitz.Rect(x, y, x + width, y + width * aspect_ratio)
+    doc[page_num - 1].insert_image(rect, stream=img_bytes)
+
+def _stage_rotate(doc, params) -> dict:
+    for page in doc:
+        page.set_rotation(params["angle"])
+    return {}
+
+def _stage_select(doc, params) -> dict:
+    runs = compile_page_ranges(params["ranges"], len(doc))
+    if not runs:
+        raise ValueError("Nenhuma página válida selecionada.")
+    doc.select([page for start, end in runs for page in range(start, end + 1)])
+    return {"garbage": 1}  # Remove os objetos das páginas descartadas
+
+def _stage_sign(doc, params) -> dict:
+    insert_signature(doc, params["image"], params["page_num"], params["x"], params["y"], params["width"])
+    return {}
+
+def _stage_compress(doc, params) -> dict:
+    """Como compress_pdf, mas sobre o documento já aberto: as imagens são recomprimidas em série,
+    pois os workers só enxergariam o arquivo original, não as edições das etapas anteriores."""
+    preset = params.get("preset")
+    if preset is None:
+        return {"garbage": 4, "deflate": True}
+    if preset not in COMPRESSION_PRESETS:
+        raise ValueError(f"Preset de compressão desconhecido: {preset}")
+    config = COMPRESSION_PRESETS[preset]
+    for xref, (width, height) in _image_targets(doc, config["dpi"]).items():
+        result = _recompress_image(doc, xref, width, height, config["quality"], len(doc.xref_stream_raw(xref)))
+        if result is not None:
+            _apply_recompressed(doc, result)
+    doc.subset_fonts()
+    return dict(COMPRESSED_SAVE_OPTIONS)
+
+def _stage_protect(doc, params) -> dict:
+    password = params["password"]
+    return {"encryption": fitz.PDF_ENCRYPT_AES_256, "owner_pw": password, "user_pw": password}
+
+# Cada etapa altera o documento aberto e devolve as opções de salvamento de que precisa
+PIPELINE_STAGES = {
+    "rotate": _stage_rotate,
+    "select": _stage_select,
+    "sign": _stage_sign,
+    "compress": _stage_compress,
+    "protect": _stage_protect,
+}
+
+def merge_save_options(combined: dict, options: dict) -> dict:
+    """Junta as opções de salvamento das etapas: níveis numéricos (garbage, use_objstms) ficam
+    com o maior valor, flags booleanas valem se alguma etapa pedir, e o resto (senhas) sobrescreve."""
+    for key, value in options.items():
+        if key in ("garbage", "use_objstms"):
+            combined[key] = max(combined.get(key, 0), value)
+        elif isinstance(value, bool):
+            combined[key] = combined.get(key, False) or value
+        else:
+            combined[key] = value
+    return combined
+
+# Operações medidas pela instrumentação (envolvidas após a definição da classe)
+INSTRUMENTED_OPERATIONS = [
+    "get_preview_image", "merge_pdfs", "split_pdf", "compress_pdf", "rotate_pdf", "protect_pdf", "sign_pdf",
+    "split_pdf_multi", "iter_text", "extract_text", "write_page_images_zip", "pdf_to_jpg", "jpg_to_pdf", "office_to_pdf", "run_pipeline",
+    "pdf_to_docx",
+]
+
+def instrument_engine(instrumentation: Instrumentation):
+    for name in INSTRUMENTED_OPERATIONS:
+        func = PDFEngine.__dict__[name].__func__
+        func = getattr(func, "__wrapped__", func)
+        setattr(PDFEngine, name, staticmethod(instrumentation.wrap(name, func)))
+
+if multiprocessing.parent_process() is None:
+    # Processos de job reimportam este arquivo e instalam a própria instrumentação (ver _run_job)
+    instrument_engine(get_instrumentation())
+
+# --- Preview de Assinatura ---
+class SignaturePreview:
+    """Simula o posicionamento da assinatura sem salvar o PDF.
+
+    A página é rasterizada e a imagem da assinatura decodificada uma única vez; cada
+    nova posição/largura só redimensiona a assinatura e a compõe sobre a página em memória.
+    """
+
+    def __init__(self, pdf_file, img_file, page_num: int, dpi: int = 72):
+        img_bytes = img_file.read() if hasattr(img_file, 'read') else img_file
+        if hasattr(img_file, 'seek'): img_file.seek(0)
+        self.key = SignaturePreview.make_key(pdf_file, img_file, page_num, dpi)
+
+        with get_render_lock(), open_pdf(pdf_file) as doc:
+            if page_num < 1 or page_num > len(doc):
+                raise ValueError("Número de página inválido.")
+            page = doc[page_num - 1]
+            pix = page.get_pixmap(dpi=dpi)
+            self.base = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+            # Coordenadas do PDF (página sem rotação) -> pixels da página exibida
+            self.matrix = page.rotation_matrix * fitz.Matrix(dpi / 72, dpi / 72)
+            rotation = page.rotation
+
+        signature = Image.open(io.BytesIO(img_bytes)).convert("RGBA")
+        self.aspect_ratio = signature.height / signature.width
+        self.signature = signature.rotate(-rotation, expand=True) if rotation else signature
+        self._scaled = (None, None)
+
+    @staticmethod
+    def make_key(pdf_file, img_file, page_num: int, dpi: int) -> tuple:
+        return (source_key(pdf_file), page_num, dpi, source_key(img_file))
+
+    def render(self, x: int, y: int, width: int, quality: int = 85) -> bytes:
+        """Compõe a assinatura na posição indicada e devolve um JPEG (codificação mais rápida que PNG)."""
+        rect = fitz.Rect(x, y, x + width, y + width * self.aspect_ratio) * self.matrix
+        size = (max(1, round(rect.width)), max(1, round(rect.height)))
+        if self._scaled[0] != size:
+            self._scaled = (size, self.signature.resize(size))
+        frame = self.base.copy()
+        frame.paste(self._scaled[1], (round(rect.x0), round(rect.y0)), self._scaled[1])
+        buffer = io.BytesIO()
+        frame.save(buffer, "JPEG", quality=quality)
+        return buffer.getvalue()
+
+# --- Miniaturas de Páginas ---
+class ThumbnailStrip:
+    """Miniaturas de páginas sob demanda, com um único fitz.Document aberto por upload.
+
+    Só a janela visível é renderizada na hora; as páginas vizinhas são pré-carregadas numa
+    thread em segundo plano e ficam no PreviewCache compartilhado. Toda chamada ao fitz,
+    inclusive a da thread, passa pelo lock de get_render_lock().
+    """
+
+    def __init__(self, pdf_file, dpi: int = 36, cache: PreviewCache = None):
+        src = pdf_source(pdf_file)
+        # Cópia própria: o documento fica aberto além da vida do upload que o originou
+        self._source = src if isinstance(src, str) else bytes(src)
+        self.digest = source_key(pdf_file)
+        self.dpi = dpi
+        self.cache = cache
+        # Guardado na instância: a thread de pré-carregamento roda fora de qualquer rerun
+        self._render_lock = get_render_lock()
+        with self._render_lock:
+            self.doc = open_pdf(self._source)
+            self.page_count = len(self.doc)
+        self._generation = 0
+        self._prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="miniaturas")
+
+    def _key(self, page_num: int) -> tuple:
+        return (self.digest, page_num, self.dpi, "thumb")
+
+    def thumbnail(self, page_num: int) -> bytes:
+        """JPEG da página (0-based), do cache ou renderizado agora."""
+        key = self._key(page_num)
+        cached = self.cache.get(key) if self.cache is not None else None
+        if cached is not None:
+            return cached[0]
+        with self._render_lock:
+            if self.doc.is_closed:
+                raise ValueError("Miniaturas fechadas: o documento saiu do cache.")
+            pix = self.doc[page_num].get_pixmap(dpi=self.dpi)
+            img_data = pix.tobytes("jpg", jpg_quality=80)
+        if self.cache is not None:
+            self.cache.put(key, img_data, self.page_count)
+        return img_data
+
+    def window(self, start: int, count: int, prefetch: int = None) -> list:
+        """Renderiza as páginas [start, start + count) e agenda `prefetch` vizinhas de cada lado."""
+        pages = range(max(0, start), min(self.page_count, start + count))
+        thumbs = [(page, self.thumbnail(page)) for page in pages]
+        self.prefetch(pages, count if prefetch is None else prefetch)
+        return thumbs
+
+    def prefetch(self, pages: range, around: int):
+        """Enfileira as páginas vizinhas da janela, primeiro as seguintes e depois as anteriores."""
+        self._generation += 1
+        generation = self._generation
+        following = range(pages.stop, min(self.page_count, pages.stop + around))
+        preceding = range(pages.start - 1, max(-1, pages.start - 1 - around), -1)
+        for page in itertools.chain(following, preceding):
+            if self.cache is None or self._key(page) not in self.cache:
+                self._prefetcher.submit(self._prefetch_one, page, generation)
+
+    def _prefetch_one(self, page_num: int, generation: int):
+        # O usuário já navegou para outra janela: descarta o pedido antigo
+        if generation == self._generation and not self.doc.is_closed:
+            self.thumbnail(page_num)
+
+    def close(self):
+        self._prefetcher.shutdown(wait=False, cancel_futures=True)
+        with self._render_lock:
+            self.doc.close()
+
+class ThumbnailStripPool:
+    """Faixas abertas, uma por upload (pelo hash do conteúdo), com no máximo `max_strips`.
+
+    A menos usada é fechada ao sair (documento e thread de pré-carregamento), em vez de esperar
+    pelo coletor de lixo.
+    """
+
+    def __init__(self, max_strips: int = 8, cache: PreviewCache = None):
+        self.max_strips = max_strips
+        self.cache = cache
+        self._strips = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, pdf_file) -> ThumbnailStrip:
+        digest = source_key(pdf_file)
+        with self._lock:
+            strip = self._strips.get(digest)
+            if strip is not None:
+                self._strips.move_to_end(digest)
+                return strip
+        strip = ThumbnailStrip(pdf_file, cache=self.cache)
+        with self._lock:
+            current = self._strips.setdefault(digest, strip)
+            evicted = [self._strips.popitem(last=False)[1] for _ in range(len(self._strips) - self.max_strips)]
+        if current is not strip:
+            strip.close()  # Outra sessão abriu o mesmo arquivo ao mesmo tempo
+        for old in evicted:
+            old.close()
+        return current
+
+    def close(self):
+        with self._lock:
+            strips, self._strips = list(self._strips.values()), OrderedDict()
+        for strip in strips:
+            strip.close()
+
+@st.cache_resource
+def get_thumbnail_pool() -> ThumbnailStripPool:
+    """Instância única do pool de miniaturas, preservada entre os reruns do Streamlit."""
+    return ThumbnailStripPool(cache=get_preview_cache())
+
+# --- Processamento em Lote (CLI) ---
+# Cada operação recebe (caminho de entrada, handle de saída, opções) e escreve o resultado em `out`
+BATCH_OPERATIONS = {
+    "compress": (".pdf", lambda f, out, o: PDFEngine.compress_pdf(f, out=out, preset=o["preset"], workers=1)),
+    "rotate": (".pdf", lambda f, out, o: PDFEngine.rotate_pdf(f, o["angle"], out=out, incremental=o["incremental"])),
+    "protect": (".pdf", lambda f, out, o: PDFEngine.protect_pdf(f, o["password"], out=out)),
+    "split": (".pdf", lambda f, out, o: PDFEngine.split_pdf(f, o["ranges"], out=out)),
+    "extract_text": (".txt", lambda f, out, o: PDFEngine.extract_text(f, o["text_format"], workers=1, out=out)),
+    "pdf_to_jpg": (".zip", lambda f, out, o: PDFEngine.write_page_images_zip(
+        f, out, o["dpi"], o["format"], o["quality"], workers=1)),
+    "pdf_to_docx": (".docx", lambda f, out, o: PDFEngine.pdf_to_docx(f, out=out, workers=1)),
+}
+
+BATCH_MANIFEST = ".cognos-batch.jsonl"
+
+def _run_batch_task(task) -> dict:
+    """Worker: aplica uma operação a um arquivo, gravando a saída de forma atômica (.part + rename)."""
+    op, in_path, out_path, opts = task
+    record = {"op": op, "input": in_path, "output": out_path, "input_bytes": os.path.getsize(in_path)}
+    start = time.perf_counter()
+    try:
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        with open(out_path + ".part", "wb") as out:
+            BATCH_OPERATIONS[op][1](in_path, out, opts)
+        os.replace(out_path + ".part", out_path)
+        record.update(status="ok", output_bytes=os.path.getsize(out_path))
+    except Exception as e:
+        if os.path.exists(out_path + ".part"): os.remove(out_path + ".part")
+        record.update(status="error", error=str(e))
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    return record
+
+def collect_batch_inputs(patterns: List[str], recursive: bool = False, exclude: str = None) -> List[str]:
+    """Expande diretórios (*.pdf) e padrões glob numa lista ordenada e sem duplicatas.
+
+    Arquivos dentro de `exclude` (o diretório de saída) são ignorados, para que as saídas de
+    uma execução não virem entradas da próxima.
+    """
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "**", "*.pdf") if recursive else os.path.join(pattern, "*.pdf")
+        paths.extend(p for p in glob.glob(pattern, recursive=recursive) if os.path.isfile(p))
+    paths = set(os.path.abspath(p) for p in paths)
+    if exclude:
+        excluded = os.path.abspath(exclude)
+        paths = {p for p in paths if os.path.commonpath([p, excluded]) != excluded}
+    return sorted(paths)
+
+def batch_output_paths(inputs: List[str], out_dir: str, ext: str) -> dict:
+    """Caminho de saída de cada entrada, espelhando sua pasta relativa à raiz comum das entradas.
+
+    Assim `a/x.pdf` e `b/x.pdf` geram `out/a/x` e `out/b/x`; se ainda houver colisão (ex.: `x.pdf`
+    e `x.PDF` virando o mesmo `.txt`), o nome completo da entrada é mantido.
+    """
+    if not inputs:
+        return {}
+    root = os.path.commonpath([os.path.dirname(p) for p in inputs])
+    outputs, taken = {}, set()
+    for in_path in inputs:
+        rel = os.path.relpath(in_path, root)
+        out_path = os.path.join(out_dir, os.path.splitext(rel)[0] + ext)
+        if out_path in taken:
+            out_path = os.path.join(out_dir, rel + ext)
+        taken.add(out_path)
+        outputs[in_path] = out_path
+    return outputs
+
+def load_batch_manifest(out_dir: str, op: str) -> set:
+    """Entradas já concluídas com sucesso numa execução anterior (para retomar o lote)."""
+    done = set()
+    manifest = os.path.join(out_dir, BATCH_MANIFEST)
+    if os.path.exists(manifest):
+        with open(manifest, encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                if rec.get("op") == op and rec.get("status") == "ok" and os.path.exists(rec.get("output", "")):
+                    done.add(rec["input"])
+    return done
+
+def run_batch(op: str, inputs: List[str], out_dir: str, opts: dict, workers: int = None,
+              resume: bool = True, log=print) -> List[dict]:
+    """Aplica `op` a todos os arquivos em paralelo, registrando o progresso no manifesto do diretório de saída."""
+    if op not in BATCH_OPERATIONS:
+        raise ValueError(f"Operação desconhecida: {op}")
+    os.makedirs(out_dir, exist_ok=True)
+    ext = BATCH_OPERATIONS[op][0]
+    if op == "extract_text":
+        ext = "." + opts.get("text_format", "txt")
+    done = load_batch_manifest(out_dir, op) if resume else set()
+    outputs = batch_output_paths(inputs, out_dir, ext)
+    tasks = [(op, in_path, outputs[in_path], opts) for in_path in inputs if in_path not in done]
+    log(f"{len(inputs)} arquivos, {len(inputs) - len(tasks)} já concluídos, {len(tasks)} a processar.")
+
+    records = []
+    with open(os.path.join(out_dir, BATCH_MANIFEST), "a", encoding="utf-8") as manifest:
+        for i, rec in enumerate(iter_parallel(_run_batch_task, tasks, workers), 1):
+            manifest.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            manifest.flush()
+            records.append(rec)
+            detail = f"{rec['input_bytes']} -> {rec['output_bytes']} bytes" if rec["status"] == "ok" else rec["error"]
+            log(f"[{i}/{len(tasks)}] {rec['status']:5} {rec['seconds']:8.2f}s  {os.path.basename(rec['input'])}  {detail}")
+    return records
+
+def run_batch_cli(argv=None) -> int:
+    """Entrada de linha de comando: python Cognos-PDF-Master.py batch <operação> <entradas...> -o <saída>"""
+    parser = argparse.ArgumentParser(prog="Cognos-PDF-Master.py batch", description="Processamento de PDFs em lote.")
+    parser.add_argument("op", choices=sorted(BATCH_OPERATIONS))
+    parser.add_argument("inputs", nargs="+", help="Diretórios ou padrões glob (ex: 'docs/**/*.pdf').")
+    parser.add_argument("-o", "--output", required=True, help="Diretório de saída.")
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument("-r", "--recursive", action="store_true")
+    parser.add_argument("--no-resume", action="store_true", help="Reprocessa arquivos já concluídos.")
+    parser.add_argument("--angle", type=int, default=90, choices=[90, 180, 270])
+    parser.add_argument("--password")
+    parser.add_argument("--preset", choices=sorted(COMPRESSION_PRESETS), help="compress: nível de compressão.")
+    parser.add_argument("--ranges")
+    parser.add_argument("--incremental", action="store_true", help="rotate: anexa só as alterações ao original.")
+    parser.add_argument("--text-format", default="txt", choices=sorted(TEXT_FORMATS), help="extract_text: formato da saída.")
+    parser.add_argument("--dpi", type=int, default=150)
+    parser.add_argument("--format", default="jpg", choices=["jpg", "png", "webp"])
+    parser.add_argument("--quality", type=int, default=95)
+    args = parser.parse_args(argv)
+
+    if args.op == "protect" and not args.password:
+        parser.error("--password é obrigatório para protect")
+    if args.op == "split" and not args.ranges:
+        parser.error("--ranges é obrigatório para split")
+
+    inputs = collect_batch_inputs(args.inputs, args.recursive, exclude=args.output)
+    if not inputs:
+        print("Nenhum arquivo encontrado.", file=sys.stderr)
+        return 1
+    opts = {k: getattr(args, k) for k in ("angle", "password", "preset", "ranges", "incremental", "text_format", "dpi", "format", "quality")}
+    start = time.perf_counter()
+    records = run_batch(args.op, inputs, args.output, opts, args.workers, resume=not args.no_resume)
+
+    ok = [r for r in records if r["status"] == "ok"]
+    in_total = sum(r["input_bytes"] for r in ok)
+    out_total = sum(r["output_bytes"] for r in ok)
+    print(f"Concluído: {len(ok)} ok, {len(records) - len(ok)} com erro, "
+          f"{in_total} -> {out_total} bytes em {time.perf_counter() - start:.2f}s.")
+    return 0 if len(ok) == len(records) else 2
+
+# --- Benchmark ---
+BENCH_SEED = 1234
+
+def _bench_image(rng: random.Random, width: int, height: int) -> Image.Image:
+    """Imagem em tons de cinza com ruído determinístico (simula uma página digitalizada)."""
+    return Image.frombytes("L", (width, height), rng.randbytes(width * height)).convert("RGB")
+
+def build_bench_corpus(corpus_dir: str, scale: int = 1) -> dict:
+    """Gera (ou reaproveita) um corpus sintético reprodutível e devolve {nome: caminho}."""
+    os.makedirs(corpus_dir, exist_ok=True)
+    words = ["documento", "relatório", "contrato", "análise", "projeto", "cliente", "valor", "prazo", "página"]
+    paragraph = lambda rng, n: " ".join(rng.choice(words) for _ in range(n))
+    corpus = {}
+
+    def build(name, writer):
+        path = os.path.join(corpus_dir, name)
+        if not os.path.exists(path):
+            # Semente própria por arquivo: recriar só parte do corpus gera o mesmo conteúdo
+            writer(path + ".part", random.Random(f"{BENCH_SEED}:{name}:{scale}"))
+            os.replace(path + ".part", path)
+        corpus[name] = path
+
+    def text_pdf(pages, lines):
+        def writer(path, rng):
+            with fitz.open() as doc:
+                for _ in range(pages):
+                    page = doc.new_page()
+                    page.insert_text((50, 60), "\n".join(paragraph(rng, 10) for _ in range(lines)), fontsize=9)
+                doc.save(path, garbage=3, deflate=True)
+        return writer
+
+    def image_pdf(pages, width, height, deflate):
+        def writer(path, rng):
+            with fitz.open() as doc:
+                for _ in range(pages):
+                    page = doc.new_page()
+                    buffer = io.BytesIO()
+                    _bench_image(rng, width, height).save(buffer, "JPEG", quality=90)
+                    page.insert_image(page.rect, stream=buffer.getvalue())
+                    page.insert_text((72, 72), paragraph(rng, 8))
+                doc.save(path, deflate=deflate)
+        return writer
+
+    build("texto.pdf", text_pdf(50 * scale, 60))
+    build("relatorio.pdf", text_pdf(5 * scale, 60))  # pdf2docx é lento: entrada menor para o caso
+    build("digitalizado.pdf", image_pdf(10 * scale, 1240, 1754, True))
+    build("muitas_paginas.pdf", text_pdf(500 * scale, 5))
+    build("grande.pdf", image_pdf(8 * scale, 2480, 3508, False))
 
-            with open(docx_path, "rb") as f:
-                docx_bytes = f.read()
+    def docx_writer(path, rng):
+        doc = Document()
+        for _ in range(200 * scale):
+            doc.add_paragraph(paragraph(rng, 40))
+        doc.save(path)
+    build("documento.docx", docx_writer)
+
+    def txt_writer(path, rng):
+        with open(path, "w", encoding="utf-8") as fh:
+            for _ in range(5000 * scale):
+                fh.write(paragraph(rng, 15) + "\n")
+    build("log.txt", txt_writer)
+
+    for i in range(3):
+        build(f"foto_{i}.jpg", lambda path, rng: _bench_image(rng, 1600, 1200).save(path, "JPEG", quality=85))
+    return corpus
+
+def _bench_open(path):
+    return open(path, "rb")
+
+# Cada caso: (entradas do corpus, função que recebe os caminhos e devolve o resultado)
+BENCH_CASES = {
+    "merge": (["texto.pdf", "muitas_paginas.pdf", "digitalizado.pdf"], lambda p, w: PDFEngine.merge_pdfs(p)),
+    "split": (["muitas_paginas.pdf"], lambda p, w: PDFEngine.split_pdf(p[0], "1-100, 150, 200-300")),
+    "compress": (["grande.pdf"], lambda p, w: PDFEngine.compress_pdf(p[0])),
+    "compress_ebook": (["digitalizado.pdf"], lambda p, w: PDFEngine.compress_pdf(p[0], preset="ebook", workers=w)),
+    "rotate": (["muitas_paginas.pdf"], lambda p, w: PDFEngine.rotate_pdf(p[0], 90)),
+    "rotate_incremental": (["grande.pdf"], lambda p, w: PDFEngine.rotate_pdf(p[0], 90, incremental=True)),
+    "protect": (["texto.pdf"], lambda p, w: PDFEngine.protect_pdf(p[0], "senha")),
+    "sign": (["grande.pdf", "foto_0.jpg"], lambda p, w: PDFEngine.sign_pdf(p[0], _bench_open(p[1]), 1, 100, 500, 150)),
+    "extract_text": (["muitas_paginas.pdf"], lambda p, w: PDFEngine.extract_text(p[0], workers=w)),
+    "pdf_to_jpg": (["digitalizado.pdf"], lambda p, w: PDFEngine.pdf_to_jpg(p[0], dpi=100, workers=w)),
+    "jpg_to_pdf": (["foto_0.jpg", "foto_1.jpg", "foto_2.jpg"], lambda p, w: PDFEngine.jpg_to_pdf([_bench_open(x) for x in p])),
+    "office_to_pdf_docx": (["documento.docx"], lambda p, w: PDFEngine.office_to_pdf(_bench_open(p[0]))),
+    "office_to_pdf_txt": (["log.txt"], lambda p, w: PDFEngine.office_to_pdf(_bench_open(p[0]))),
+    "pdf_to_docx": (["relatorio.pdf"], lambda p, w: PDFEngine.pdf_to_docx(p[0], workers=w)),
+}
+
+def _bench_task(case: str, paths: List[str], workers: int, trace: bool, conn):
+    """Processo isolado por caso: o pico de memória medido é só desta operação.
+
+    Com `trace`, mede só o pico de memória Python (tracemalloc); sem ele, só tempo e RSS,
+    pois o tracemalloc deixa operações com muitas alocações em Python várias vezes mais lentas.
+    """
+    try:
+        if trace:
+            tracemalloc.start()
+            result = BENCH_CASES[case][1](paths, workers)
+            _, py_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            conn.send({"py_peak_bytes": py_peak, "output_bytes": len(result)})
+            return
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = BENCH_CASES[case][1](paths, workers)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None
+        conn.send({"wall_s": wall, "cpu_s": cpu, "peak_rss_kb": peak_rss, "output_bytes": len(result)})
+    except Exception as e:
+        conn.send({"error": str(e)})
+    finally:
+        conn.close()
+
+def run_benchmarks(corpus: dict, cases: List[str] = None, repeat: int = 3, workers: int = 1, log=print) -> dict:
+    """Executa cada caso `repeat` vezes em processos separados e devolve o relatório (mediana + amostras).
+
+    Os tempos vêm de execuções sem tracemalloc; uma execução extra mede o pico de memória Python.
+    """
+    def run_once(case, paths, trace):
+        recv, send = multiprocessing.Pipe(duplex=False)
+        proc = multiprocessing.Process(target=_bench_task, args=(case, paths, workers, trace, send))
+        proc.start()
+        send.close()
+        sample = recv.recv() if recv.poll(None) else {"error": "sem resposta"}
+        proc.join()
+        return sample
+
+    results = []
+    for case in cases or list(BENCH_CASES):
+        paths = [corpus[name] for name in BENCH_CASES[case][0]]
+        samples = []
+        for _ in range(repeat):
+            sample = run_once(case, paths, trace=False)
+            if "error" in sample:
+                break
+            samples.append(sample)
+        # Memória numa execução à parte; uma falha aqui não descarta os tempos já medidos
+        memory = run_once(case, paths, trace=True) if samples else {}
+        entry = {"case": case, "inputs": BENCH_CASES[case][0],
+                 "input_bytes": sum(os.path.getsize(p) for p in paths), "repeat": len(samples)}
+        if samples:
+            entry.update({
+                "wall_s": round(statistics.median(s["wall_s"] for s in samples), 4),
+                "wall_samples": [round(s["wall_s"], 4) for s in samples],
+                "cpu_s": round(statistics.median(s["cpu_s"] for s in samples), 4),
+                "py_peak_bytes": memory.get("py_peak_bytes"),
+                "peak_rss_kb": max(s["peak_rss_kb"] for s in samples) if resource else None,
+                "output_bytes": samples[-1]["output_bytes"],
+            })
+            log(f"{case:20} {entry['wall_s']:8.3f}s  cpu {entry['cpu_s']:8.3f}s  rss {entry['peak_rss_kb']} kB")
+        else:
+            entry["error"] = sample["error"]
+            log(f"{case:20} ERRO: {sample['error']}")
+        results.append(entry)
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pymupdf": fitz.VersionBind,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "workers": workers,
+        "results": results,
+    }
+
+def compare_benchmarks(baseline: dict, current: dict, threshold: float = 0.10) -> List[str]:
+    """Linhas de comparação por caso; marca regressões de tempo acima de `threshold`."""
+    before = {r["case"]: r for r in baseline.get("results", []) if "wall_s" in r}
+    lines = []
+    for r in current["results"]:
+        old = before.get(r["case"])
+        if not old or "wall_s" not in r:
+            continue
+        ratio = r["wall_s"] / old["wall_s"] if old["wall_s"] else float("inf")
+        flag = "REGRESSÃO" if ratio > 1 + threshold else ("melhora" if ratio < 1 - threshold else "")
+        lines.append(f"{r['case']:20} {old['wall_s']:8.3f}s -> {r['wall_s']:8.3f}s ({ratio:5.2f}x) {flag}")
+    return lines
+
+def run_bench_cli(argv=None) -> int:
+    """Entrada de linha de comando: python Cognos-PDF-Master.py bench [-o resultado.json]"""
+    parser = argparse.ArgumentParser(prog="Cognos-PDF-Master.py bench", description="Benchmark do PDFEngine.")
+    parser.add_argument("cases", nargs="*", help=f"Casos a executar (padrão: todos): {', '.join(BENCH_CASES)}")
+    parser.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "cognos-bench-corpus"))
+    parser.add_argument("--scale", type=int, default=1, help="Multiplica o tamanho do corpus.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("-w", "--workers", type=int, default=1)
+    parser.add_argument("-o", "--output", help="Grava o relatório JSON neste arquivo.")
+    parser.add_argument("--compare", help="Relatório JSON anterior para comparação.")
+    args = parser.parse_args(argv)
+
+    unknown = [c for c in args.cases if c not in BENCH_CASES]
+    if unknown:
+        parser.error(f"casos desconhecidos: {', '.join(unknown)}")
+    corpus = build_bench_corpus(os.path.join(args.corpus, f"escala_{args.scale}"), args.scale)
+    report = run_benchmarks(corpus, args.cases, args.repeat, args.workers)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            print("\n".join(compare_benchmarks(json.load(fh), report)))
+    return 0 if all("error" not in r for r in report["results"]) else 2
+
+# --- Fila de Jobs (execução em segundo plano) ---
+# Cada operação recebe (argumentos, handle de saída, callback de progresso); um dict devolvido vira metadado do job.
+# Os jobs usam workers=1: o paralelismo é limitado pelo JobManager, não por cada operação.
+JOB_OPERATIONS = {
+    "merge": lambda a, out, p: _merge_job(a, out),
+    "split": lambda a, out, p: PDFEngine.split_pdf(a["file"], a["ranges"], out=out),
+    "split_multi": lambda a, out, p: _split_multi_job(a, out),
+    "sign": lambda a, out, p: PDFEngine.sign_pdf(a["file"], a["image"], a["page_num"], a["x"], a["y"], a["width"],
+                                                 out=out, incremental=a["incremental"]),
+    "protect": lambda a, out, p: PDFEngine.protect_pdf(a["file"], a["password"], out=out),
+    "rotate": lambda a, out, p: PDFEngine.rotate_pdf(a["file"], a["angle"], out=out,
+                                                     incremental=a["incremental"]),
+    "compress": lambda a, out, p: _compress_job(a, out),
+    "extract_text": lambda a, out, p: PDFEngine.extract_text(a["file"], a["fmt"], workers=1, out=out, progress=p),
+    "pdf_jpg": lambda a, out, p: PDFEngine.write_page_images_zip(a["file"], out, a["dpi"], a["fmt"], a["quality"],
+                                                                 workers=1, progress=p),
+    "jpg_pdf": lambda a, out, p: PDFEngine.jpg_to_pdf([io.BytesIO(b) for b in a["images"]], out=out, progress=p,
+                                                      **a.get("options", {})),
+    "office_pdf": lambda a, out, p: PDFEngine.office_to_pdf(_named_buffer(a["data"], a["name"]), out=out),
+    "pdf_docx": lambda a, out, p: PDFEngine.pdf_to_docx(a["file"], out=out, workers=1, progress=p),
+    "pipeline": lambda a, out, p: _pipeline_job(a, out),
+}
+
+JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED, JOB_CANCELLED = "na fila", "executando", "concluído", "erro", "cancelado"
+
+class JobRejected(RuntimeError):
+    """Fila cheia ou limite de jobs da sessão atingido (controle de admissão)."""
+
+def _named_buffer(data: bytes, name: str) -> io.BytesIO:
+    buffer = io.BytesIO(data)
+    buffer.name = name
+    return buffer
+
+def _split_multi_job(args, out) -> dict:
+    stats = []
+    PDFEngine.split_pdf_multi(args["file"], args["mode"], args["value"], out=out, stats=stats)
+    return {"stats": stats}
+
+def _merge_job(args, out) -> dict:
+    stats = []
+    PDFEngine.merge_pdfs([_named_buffer(data, name) for name, data in args["files"]], out=out, workers=1,
+                         dedupe=args.get("dedupe", False), stats=stats)
+    return {"stats": stats}
+
+def _compress_job(args, out) -> dict:
+    stats = []
+    PDFEngine.compress_pdf(args["file"], out=out, preset=args["preset"], workers=1, stats=stats)
+    return {"stats": stats}
+
+def _pipeline_job(args, out) -> dict:
+    stats = []
+    PDFEngine.run_pipeline(args["file"], args["steps"], out=out, stats=stats)
+    return {"stats": stats}
+
+# Jobs não usam fork: o servidor do Streamlit tem várias threads, e um fork copiaria locks presos por elas
+if "forkserver" in multiprocessing.get_all_start_methods():
+    JOB_CONTEXT = multiprocessing.get_context("forkserver")
+    JOB_CONTEXT.set_forkserver_preload(["streamlit", "fitz", "pdf2docx", "reportlab.platypus", "docx"])
+else:
+    JOB_CONTEXT = multiprocessing.get_context("spawn")
+
+def _run_job(op: str, args: dict, out_path: str, progress, conn):
+    """Processo do job: grava o resultado em `out_path` e envia (status, metadados/erro) pelo pipe."""
+    records = []
+    instrument_engine(new_instrumentation(records.append))  # Métricas voltam ao processo principal com o resultado
+    try:
+        with open(out_path, "wb") as out:
+            meta = JOB_OPERATIONS[op](args, out, lambda fraction: setattr(progress, "value", fraction))
+        progress.value = 1.0
+        conn.send((JOB_DONE, meta if isinstance(meta, dict) else {}, records))
+    except Exception as e:
+        conn.send((JOB_FAILED, str(e), records))
+    finally:
+        conn.close()
+
+class Job:
+    """Handle de um job: estado, progresso e caminho do resultado."""
+
+    def __init__(self, session_id: str, op: str, args: dict, out_path: str):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.op = op
+        self.args = args
+        self.out_path = out_path
+        self.status = JOB_QUEUED
+        self.error = None
+        self.meta = {}
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._progress = JOB_CONTEXT.Value("d", 0.0)
+        self._process = None
+        self._conn = None
+
+    @property
+    def progress(self) -> float:
+        return self._progress.value
+
+    @property
+    def active(self) -> bool:
+        return self.status in (JOB_QUEUED, JOB_RUNNING)
+
+    def read_result(self) -> bytes:
+        with open(self.out_path, "rb") as fh:
+            return fh.read()
+
+class JobManager:
+    """Executa operações longas em processos separados, com no máximo `max_workers` simultâneos.
+
+    Controle de admissão: recusa novos jobs quando há `max_pending` jobs ativos no total ou
+    `max_per_session` na mesma sessão. Jobs em execução podem ser cancelados (o processo é encerrado).
+    """
+
+    def __init__(self, max_workers: int = None, max_pending: int = None, max_per_session: int = 2,
+                 retention: int = 3600):
+        self.max_workers = max_workers or default_workers()
+        self.max_pending = max_pending or self.max_workers * 4
+        self.max_per_session = max_per_session
+        self.retention = retention
+        self.work_dir = tempfile.mkdtemp(prefix="cognos-jobs-")
+        self._jobs = OrderedDict()
+        self._lock = threading.Condition()
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, session_id: str, op: str, args: dict) -> Job:
+        if op not in JOB_OPERATIONS:
+            raise ValueError(f"Operação desconhecida: {op}")
+        with self._lock:
+            active = [j for j in self._jobs.values() if j.active]
+            if len(active) >= self.max_pending:
+                raise JobRejected("Servidor ocupado: muitos jobs na fila. Tente novamente em instantes.")
+            if sum(j.session_id == session_id for j in active) >= self.max_per_session:
+                raise JobRejected("Você já tem jobs em andamento. Aguarde a conclusão ou cancele um deles.")
+            job = Job(session_id, op, args, "")
+            job.out_path = os.path.join(self.work_dir, job.id)
+            self._jobs[job.id] = job
+            self._lock.notify()
+            return job
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs_for(self, session_id: str) -> List[Job]:
+        with self._lock:
+            return [j for j in self._jobs.values() if j.session_id == session_id]
+
+    def cancel(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or not job.active:
+                return
+            if job._process is not None:
+                job._process.terminate()
+                job._process.join()
+                job._conn.close()
+            self._finish(job, JOB_CANCELLED)
+            self._lock.notify()
+
+    def discard(self, job_id: str):
+        """Cancela se necessário e remove o job e o arquivo de resultado."""
+        self.cancel(job_id)
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is not None and os.path.exists(job.out_path):
+            os.remove(job.out_path)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return counts
+
+    def _finish(self, job: Job, status: str, error: str = None):
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        job._process = job._conn = None
+        job.args = None  # Libera os bytes de entrada
+
+    def _dispatch_loop(self):
+        while True:
+            with self._lock:
+                self._reap()
+                running = sum(j.status == JOB_RUNNING for j in self._jobs.values())
+                for job in self._jobs.values():
+                    if running >= self.max_workers:
+                        break
+                    if job.status == JOB_QUEUED:
+                        self._start(job)
+                        running += 1
+                self._lock.wait(timeout=0.2)
+
+    def _start(self, job: Job):
+        recv, send = JOB_CONTEXT.Pipe(duplex=False)
+        # O Streamlit recria o módulo __main__ a cada rerun e o pickle do alvo exige a função do módulo atual
+        target = getattr(sys.modules.get(_run_job.__module__), "_run_job", _run_job)
+        process = JOB_CONTEXT.Process(
+            target=target, args=(job.op, job.args, job.out_path, job._progress, send), daemon=True)
+        try:
+            process.start()
+        except Exception as e:  # Ex.: argumentos que não podem ser serializados para o processo
+            recv.close()
+            self._finish(job, JOB_FAILED, f"Não foi possível iniciar o job: {e}")
+            return
         finally:
-            # Limpeza dos arquivos temporários
-            if os.path.exists(tmp_pdf_path): os.remove(tmp_pdf_path)
-            if os.path.exists(docx_path): os.remove(docx_path)
-            
-        return docx_bytes
+            send.close()
+        job._process = process
+        job._conn = recv
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+
+    def _reap(self):
+        now = time.time()
+        for job in list(self._jobs.values()):
+            if job.status == JOB_RUNNING:
+                if job._conn.poll():
+                    status, payload, records = job._conn.recv()
+                    job._process.join()
+                    for record in records:
+                        get_instrumentation().record(record, emit=False)
+                    if status == JOB_DONE:
+                        job.meta = payload
+                        self._finish(job, JOB_DONE)
+                    else:
+                        self._finish(job, JOB_FAILED, payload)
+                elif not job._process.is_alive() and not job._conn.poll():
+                    self._finish(job, JOB_FAILED, f"Processo encerrado inesperadamente (código {job._process.exitcode}).")
+            elif not job.active and now - job.finished_at > self.retention:
+                self._jobs.pop(job.id)
+                if os.path.exists(job.out_path):
+                    os.remove(job.out_path)
+
+@st.cache_resource
+def get_job_manager() -> JobManager:
+    """Fila única compartilhada por todas as sessões do servidor."""
+    return JobManager()
 
 # --- Helpers de UI ---
 def ui_show_pdf_preview(file, label="Preview (Pág. 1)", expanded=True):
@@ -264,6 +2309,79 @@ def ui_show_pdf_preview(file, label="Preview (Pág. 1)", expanded=True):
         else:
             st.warning("Não foi possível gerar preview deste arquivo.")
 
+def ui_page_strip(file, key: str, per_view: int = 6, on_pick=None, pick_label: str = "Usar"):
+    """Faixa navegável de miniaturas; só a janela visível é renderizada.
+
+    Com `on_pick`, cada miniatura ganha um botão que chama `on_pick(número_da_página)`.
+    """
+    try:
+        strip = get_thumbnail_pool().get(file)
+    except Exception:
+        st.warning("Não foi possível gerar as miniaturas deste arquivo.")
+        return
+    start_key = f"{key}_strip_start"
+    last_start = max(0, strip.page_count - per_view)
+    start = min(st.session_state.get(start_key, 0), last_start)
+
+    def move(delta):
+        st.session_state[start_key] = max(0, min(start + delta, last_start))
+
+    nav_prev, nav_info, nav_next = st.columns([1, 4, 1])
+    nav_prev.button("◀", key=f"{key}_strip_prev", on_click=move, args=(-per_view,), disabled=start == 0)
+    nav_info.caption(f"Páginas {start + 1}–{min(start + per_view, strip.page_count)} de {strip.page_count}")
+    nav_next.button("▶", key=f"{key}_strip_next", on_click=move, args=(per_view,), disabled=start >= last_start)
+    try:
+        thumbs = strip.window(start, per_view)
+    except ValueError:
+        st.info("Miniaturas recarregando, atualize a página.")  # Faixa fechada pelo pool durante o rerun
+        return
+    for col, (page, img_data) in zip(st.columns(per_view), thumbs):
+        col.image(img_data, caption=f"Pág. {page + 1}", use_container_width=True)
+        if on_pick:
+            col.button(pick_label, key=f"{key}_pick_{page}", on_click=on_pick, args=(page + 1,))
+
+def ui_session_id() -> str:
+    if 'session_id' not in st.session_state:
+        st.session_state['session_id'] = uuid.uuid4().hex
+    return st.session_state['session_id']
+
+def ui_run_job(tool, label, make_args, file_name, mime, on_done=None, on_progress=None):
+    """Botão que envia a operação para a fila de jobs e acompanha o job desta sessão até o download.
+
+    `make_args` só é chamado no clique (valor falso esconde o botão); `on_done(job)` mostra o resultado
+    e `on_progress(job)`, chamado a cada atualização enquanto o job roda, mostra resultados parciais.
+    """
+    manager = get_job_manager()
+    state_key = f"job_{tool}"
+    if make_args and st.button(label, type="primary"):
+        if st.session_state.get(state_key):
+            manager.discard(st.session_state.pop(state_key))
+        try:
+            st.session_state[state_key] = manager.submit(ui_session_id(), tool, make_args()).id
+        except JobRejected as e:
+            st.warning(str(e))
+            return
+
+    job = manager.get(st.session_state[state_key]) if st.session_state.get(state_key) else None
+    if job is None:
+        return
+    if job.active:
+        text = "Aguardando na fila..." if job.status == JOB_QUEUED else f"Processando... {job.progress * 100:.0f}%"
+        st.progress(job.progress, text=text)
+        if on_progress: on_progress(job)
+        if st.button("Cancelar", key=f"cancel_{tool}"):
+            manager.cancel(job.id)
+        # Acompanha o job sem bloquear o servidor: novo rerun em meio segundo
+        time.sleep(0.5)
+        st.rerun()
+    elif job.status == JOB_DONE:
+        if on_done: on_done(job)
+        st.download_button(f"Baixar ({file_name})", job.read_result(), file_name, mime)
+    elif job.status == JOB_FAILED:
+        st.error(f"Erro: {job.error}")
+    else:
+        st.info("Job cancelado.")
+
 def navigate_to(tool_name):
     st.session_state['active_tool'] = tool_name
 
@@ -285,7 +2403,8 @@ def render_home():
         {"id": "jpg_pdf", "icon": "📷", "title": "JPG p/ PDF", "desc": "Imagens em PDF."},
         {"id": "office_pdf", "icon": "📄", "title": "Word p/ PDF", "desc": "DOCX simples p/ PDF."},
         # ### NOVO: Card adicionado ###
-        {"id": "pdf_docx", "icon": "📘", "title": "PDF p/ Word", "desc": "Converta para DOCX."} 
+        {"id": "pdf_docx", "icon": "📘", "title": "PDF p/ Word", "desc": "Converta para DOCX."},
+        {"id": "pipeline", "icon": "🧩", "title": "Pipeline", "desc": "Encadeie várias operações."},
     ]
 
     cols = st.columns(4)
@@ -326,23 +2445,45 @@ def render_tool_page():
                         with cols_prev[idx % 3]:
                             ui_show_pdf_preview(f, label=f.name, expanded=True)
             
-            if files and st.button("Juntar PDFs", type="primary"):
-                with st.spinner("Processando..."):
-                    res = PDFEngine.merge_pdfs(files)
-                    st.success("Concluído!")
-                    st.download_button("Baixar PDF Unido", res, "merged.pdf", "application/pdf")
+            dedupe = st.checkbox("Unificar fontes e imagens repetidas entre os arquivos",
+                                 help="Gera um PDF menor quando os arquivos compartilham recursos, mas fica bem mais lento com muitos arquivos.")
+            def show_merged(job):
+                st.success("Concluído!")
+                with st.expander("Tempo por arquivo"):
+                    st.table(job.meta.get("stats", []))
+            ui_run_job("merge", "Juntar PDFs", files and (lambda: {"files": [(f.name, f.getvalue()) for f in files], "dedupe": dedupe}),
+                       "merged.pdf", "application/pdf", on_done=show_merged)
 
         # --- DIVIDIR ---
         elif tool == "split":
             file = st.file_uploader("Selecione PDF", type="pdf")
             if file:
-                ui_show_pdf_preview(file, "👁️ Preview do Documento")
-                
-            ranges = st.text_input("Intervalo (ex: 1-5, 8)", help="Use hífen para intervalos e vírgula para páginas soltas.")
-            if file and ranges and st.button("Dividir PDF", type="primary"):
-                res = PDFEngine.split_pdf(file, ranges)
-                st.success("Concluído!")
-                st.download_button("Baixar PDF Dividido", res, "split.pdf", "application/pdf")
+                with st.expander("👁️ Páginas do Documento", expanded=True):
+                    ui_page_strip(file, "split")
+
+            modes = {"single": "Um PDF com as páginas escolhidas", "ranges": "Um PDF por intervalo",
+                     "every": "A cada N páginas", "bookmarks": "Por marcadores", "size": "Por tamanho máximo"}
+            mode = st.radio("Modo", list(modes), format_func=modes.get, horizontal=True)
+            if mode in ("single", "ranges"):
+                value = st.text_input("Intervalo (ex: 1-5, 8)", help="Use hífen para intervalos e vírgula para páginas soltas.")
+            elif mode == "every":
+                value = st.number_input("Páginas por arquivo", min_value=1, value=10)
+            elif mode == "bookmarks":
+                value = st.number_input("Nível do marcador", min_value=1, value=1)
+            else:
+                value = st.number_input("Tamanho máximo por arquivo (MB)", min_value=1, value=10) * 1024 * 1024
+
+            if mode == "single":
+                ui_run_job("split", "Dividir PDF", file and value and (lambda: {"file": file.getvalue(), "ranges": value}),
+                           "split.pdf", "application/pdf", on_done=lambda job: st.success("Concluído!"))
+            else:
+                def show_parts(job):
+                    st.success(f"{len(job.meta.get('stats', []))} arquivos gerados!")
+                    with st.expander("Arquivos"):
+                        st.table(job.meta.get("stats", []))
+                ui_run_job("split_multi", "Dividir PDF",
+                           file and value and (lambda: {"file": file.getvalue(), "mode": mode, "value": value}),
+                           "partes.zip", "application/zip", on_done=show_parts)
 
         # --- ASSINAR ---
         elif tool == "sign":
@@ -353,127 +2494,226 @@ def render_tool_page():
                 img_sign = st.file_uploader("2. Imagem (PNG/JPG)", type=["png", "jpg", "jpeg"])
             
             if file and img_sign:
+                with st.expander("📄 Escolha a página", expanded=False):
+                    ui_page_strip(file, "sign", on_pick=lambda n: st.session_state.update(sign_page=n))
                 st.write("Configurações da Assinatura:")
                 c1, c2, c3, c4 = st.columns(4)
-                with c1: page_num = st.number_input("Página", min_value=1, value=1)
+                with c1: page_num = st.number_input("Página", min_value=1, key="sign_page")
                 with c2: width = st.slider("Largura", 50, 500, 150)
                 with c3: x_pos = st.slider("Posição X", 0, 600, 100)
                 with c4: y_pos = st.slider("Posição Y", 0, 800, 500)
                 
-                if st.button("👁️ Testar Posição (Gerar Preview)"):
-                     try:
-                        temp_pdf = PDFEngine.sign_pdf(file, img_sign, page_num, x_pos, y_pos, width)
-                        with fitz.open(stream=temp_pdf, filetype="pdf") as doc:
-                            page = doc[page_num - 1]
-                            pix = page.get_pixmap(dpi=100)
-                            st.image(pix.tobytes("png"), caption="Simulação da Assinatura", use_container_width=True)
-                     except Exception as e:
-                         st.error(f"Erro no preview: {e}")
-
-                if st.button("Aplicar Assinatura Definitiva", type="primary"):
-                    res = PDFEngine.sign_pdf(file, img_sign, page_num, x_pos, y_pos, width)
-                    st.success("Assinado!")
-                    st.download_button("Baixar PDF Assinado", res, "signed.pdf", "application/pdf")
+                with st.expander("👁️ Preview da Posição", expanded=True):
+                    try:
+                        # Reaproveita a página rasterizada e a assinatura decodificada entre os reruns
+                        preview = st.session_state.get('sign_preview')
+                        key = SignaturePreview.make_key(file, img_sign, page_num, 72)
+                        if preview is None or preview.key != key:
+                            preview = SignaturePreview(file, img_sign, page_num)
+                            st.session_state['sign_preview'] = preview
+                        st.image(preview.render(x_pos, y_pos, width), caption="Simulação da Assinatura", use_container_width=True)
+                    except Exception as e:
+                        st.error(f"Erro no preview: {e}")
+
+                incremental = st.checkbox("Salvamento incremental (preserva assinaturas digitais existentes)", value=True)
+                ui_run_job("sign", "Aplicar Assinatura Definitiva",
+                           lambda: {"file": file.getvalue(), "image": img_sign.getvalue(), "page_num": page_num,
+                                    "x": x_pos, "y": y_pos, "width": width, "incremental": incremental},
+                           "signed.pdf", "application/pdf", on_done=lambda job: st.success("Assinado!"))
 
         # --- PROTEGER ---
         elif tool == "protect":
             file = st.file_uploader("Selecione PDF", type="pdf")
             if file: ui_show_pdf_preview(file)
             password = st.text_input("Defina uma senha", type="password")
-            if file and password and st.button("Proteger PDF", type="primary"):
-                res = PDFEngine.protect_pdf(file, password)
-                st.success("Protegido!")
-                st.download_button("Baixar PDF Protegido", res, "protected.pdf", "application/pdf")
+            ui_run_job("protect", "Proteger PDF", file and password and (lambda: {"file": file.getvalue(), "password": password}),
+                       "protected.pdf", "application/pdf", on_done=lambda job: st.success("Protegido!"))
 
         # --- ROTACIONAR ---
         elif tool == "rotate":
             file = st.file_uploader("Selecione PDF", type="pdf")
-            if file: ui_show_pdf_preview(file, label="Estado Atual")
+            if file:
+                with st.expander("Estado Atual", expanded=True):
+                    ui_page_strip(file, "rotate")
             angle = st.select_slider("Ângulo de Rotação", options=[90, 180, 270])
-            if file and st.button("Rotacionar", type="primary"):
-                res = PDFEngine.rotate_pdf(file, angle)
+            incremental = st.checkbox("Salvamento incremental (mais rápido em arquivos grandes)", value=True)
+            def show_rotated(job):
                 st.success("Rotacionado!")
                 with st.expander("Resultado"):
-                     img_res, _ = PDFEngine.get_preview_image(io.BytesIO(res))
+                     img_res, _ = PDFEngine.get_preview_image(job.out_path)
                      st.image(img_res, caption="Como ficou", use_container_width=True)
-                st.download_button("Baixar PDF Rotacionado", res, "rotated.pdf", "application/pdf")
+            ui_run_job("rotate", "Rotacionar", file and (lambda: {"file": file.getvalue(), "angle": angle, "incremental": incremental}),
+                       "rotated.pdf", "application/pdf", on_done=show_rotated)
 
         # --- EXTRAIR TEXTO ---
         elif tool == "extract_text":
             file = st.file_uploader("Selecione PDF", type="pdf")
             if file: ui_show_pdf_preview(file)
-            if file and st.button("Extrair Texto", type="primary"):
-                res = PDFEngine.extract_text(file)
+            fmt = st.radio("Formato", list(TEXT_FORMATS), horizontal=True,
+                           help="JSON/NDJSON incluem os blocos de texto de cada página com suas coordenadas.")
+            def show_text_preview(job):
+                # O job grava o texto página a página: as primeiras aparecem antes do fim da extração
+                if os.path.exists(job.out_path):
+                    with open(job.out_path, "rb") as fh:
+                        text = fh.read(1000).decode("utf-8", errors="ignore")
+                    if text: st.text_area("Preview Texto", text + "...", height=200)
+            def show_extracted(job):
                 st.success("Extraído!")
-                st.text_area("Preview Texto", res.decode('utf-8')[:1000] + "...", height=200)
-                st.download_button("Baixar Texto (.txt)", res, "conteudo.txt", "text/plain")
+                show_text_preview(job)
+            ui_run_job("extract_text", "Extrair Texto", file and (lambda: {"file": file.getvalue(), "fmt": fmt}),
+                       f"conteudo.{fmt}", TEXT_FORMATS[fmt], on_done=show_extracted, on_progress=show_text_preview)
 
         # --- COMPRIMIR ---
         elif tool == "compress":
             file = st.file_uploader("Selecione PDF", type="pdf")
             if file: ui_show_pdf_preview(file)
-            if file and st.button("Comprimir PDF", type="primary"):
-                res = PDFEngine.compress_pdf(file)
-                st.success(f"Redução de {(1 - (len(res) / file.size)) * 100:.1f}%")
-                st.download_button("Baixar Otimizado", res, "compressed.pdf", "application/pdf")
+            preset = st.radio("Nível de compressão", ["básico", "print", "ebook", "screen"], horizontal=True,
+                              help="screen: 72 DPI; ebook: 150 DPI; print: 300 DPI. 'básico' não altera as imagens.")
+            def show_reduction(job):
+                st.success(f"Redução de {(1 - (os.path.getsize(job.out_path) / file.size)) * 100:.1f}%")
+                if job.meta.get("stats"): st.table(job.meta["stats"])
+            ui_run_job("compress", "Comprimir PDF",
+                       file and (lambda: {"file": file.getvalue(), "preset": None if preset == "básico" else preset}),
+                       "compressed.pdf", "application/pdf", on_done=show_reduction)
 
         # --- PDF PARA JPG ---
         elif tool == "pdf_jpg":
             file = st.file_uploader("Selecione PDF", type="pdf")
             if file: ui_show_pdf_preview(file)
-            if file and st.button("Converter", type="primary"):
-                res = PDFEngine.pdf_to_jpg(file)
-                st.download_button("Baixar ZIP", res, "imagens.zip", "application/zip")
+            c1, c2, c3 = st.columns(3)
+            with c1: fmt = st.selectbox("Formato", ["jpg", "png", "webp"])
+            with c2: dpi = st.slider("Resolução (DPI)", 72, 300, 150)
+            with c3: quality = st.slider("Qualidade", 10, 100, 95, disabled=(fmt == "png"))
+            ui_run_job("pdf_jpg", "Converter", file and (lambda: {"file": file.getvalue(), "dpi": dpi, "fmt": fmt, "quality": quality}),
+                       "imagens.zip", "application/zip")
 
         # --- JPG PARA PDF ---
         elif tool == "jpg_pdf":
             files = st.file_uploader("Selecione Imagens", type=["jpg", "png", "jpeg"], accept_multiple_files=True)
             if files:
-                st.image(files, width=150, caption=[f.name for f in files])
-            if files and st.button("Gerar PDF", type="primary"):
-                res = PDFEngine.jpg_to_pdf(files)
+                # Miniaturas só das primeiras: centenas de fotos no navegador travam a página
+                st.image(files[:12], width=150, caption=[f.name for f in files[:12]])
+                if len(files) > 12: st.caption(f"... e mais {len(files) - 12} imagens.")
+            c1, c2, c3 = st.columns(3)
+            with c1:
+                page_size = st.selectbox("Tamanho da página", list(PAGE_SIZES),
+                                         format_func={"original": "Igual à imagem", "a4": "A4", "letter": "Carta"}.get)
+            with c2:
+                fit = st.selectbox("Encaixe", FIT_MODES, disabled=(page_size == "original"),
+                                   format_func={"contain": "Inteira", "cover": "Preencher (recorta)", "stretch": "Esticar"}.get)
+            with c3:
+                max_side = st.selectbox("Reduzir fotos para", [None, 3000, 2000, 1200],
+                                        format_func=lambda v: "Não reduzir" if v is None else f"{v} px")
+            def show_generated(job):
                 st.success("Gerado!")
-                img_res, _ = PDFEngine.get_preview_image(io.BytesIO(res))
+                img_res, _ = PDFEngine.get_preview_image(job.out_path)
                 st.image(img_res, caption="PDF Gerado", width=300)
-                st.download_button("Baixar PDF", res, "photos.pdf", "application/pdf")
+            ui_run_job("jpg_pdf", "Gerar PDF", files and (lambda: {"images": [f.getvalue() for f in files],
+                                                                "options": {"page_size": page_size, "fit": fit, "max_side": max_side}}),
+                       "photos.pdf", "application/pdf", on_done=show_generated)
 
         # --- OFFICE PARA PDF ---
         elif tool == "office_pdf":
             file = st.file_uploader("DOCX ou TXT", type=["docx", "txt"])
-            if file and st.button("Converter", type="primary"):
-                res = PDFEngine.office_to_pdf(file)
+            def show_converted(job):
                 st.success("Convertido!")
-                ui_show_pdf_preview(io.BytesIO(res), "Como ficou o PDF")
-                st.download_button("Baixar PDF", res, "doc.pdf", "application/pdf")
+                ui_show_pdf_preview(job.out_path, "Como ficou o PDF")
+            ui_run_job("office_pdf", "Converter", file and (lambda: {"data": file.getvalue(), "name": file.name}),
+                       "doc.pdf", "application/pdf", on_done=show_converted)
         
         # ### NOVO: Lógica da Interface PDF -> DOCX ###
         elif tool == "pdf_docx":
             file = st.file_uploader("Selecione PDF", type="pdf")
             if file: ui_show_pdf_preview(file)
-            if file and st.button("Converter para Word", type="primary"):
-                with st.spinner("Convertendo... (Isso pode levar alguns segundos)"):
-                    res = PDFEngine.pdf_to_docx(file)
-                    st.success("Convertido com sucesso!")
-                    st.download_button(
-                        label="Baixar Arquivo Word (.docx)",
-                        data=res,
-                        file_name="convertido.docx",
-                        mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-                    )
+            ui_run_job("pdf_docx", "Converter para Word", file and (lambda: {"file": file.getvalue()}),
+                       "convertido.docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                       on_done=lambda job: st.success("Convertido com sucesso!"))
+
+        # --- PIPELINE ---
+        elif tool == "pipeline":
+            file = st.file_uploader("Selecione PDF", type="pdf")
+            if file: ui_show_pdf_preview(file, expanded=False)
+            stages = {"rotate": "🔄 Rotacionar", "select": "✂️ Selecionar páginas", "sign": "✍️ Assinar",
+                      "compress": "🗜️ Comprimir", "protect": "🔒 Proteger"}
+            chosen = st.multiselect("Operações, na ordem de execução", list(stages), format_func=stages.get,
+                                    help="O PDF é aberto uma vez e salvo uma vez ao final, qualquer que seja o número de etapas.")
+            steps, ready = [], True
+            for n, name in enumerate(chosen, 1):
+                with st.expander(f"{n}. {stages[name]}", expanded=True):
+                    if name == "rotate":
+                        params = {"angle": st.select_slider("Ângulo", options=[90, 180, 270], key=f"pipe_angle_{n}")}
+                    elif name == "select":
+                        params = {"ranges": st.text_input("Intervalo (ex: 1-5, 8)", key=f"pipe_ranges_{n}")}
+                        ready = ready and bool(params["ranges"])
+                    elif name == "sign":
+                        img_sign = st.file_uploader("Imagem (PNG/JPG)", type=["png", "jpg", "jpeg"], key=f"pipe_img_{n}")
+                        c1, c2, c3, c4 = st.columns(4)
+                        with c1: page_num = st.number_input("Página", min_value=1, key=f"pipe_page_{n}")
+                        with c2: width = st.slider("Largura", 50, 500, 150, key=f"pipe_width_{n}")
+                        with c3: x_pos = st.slider("Posição X", 0, 600, 100, key=f"pipe_x_{n}")
+                        with c4: y_pos = st.slider("Posição Y", 0, 800, 500, key=f"pipe_y_{n}")
+                        params = {"image": img_sign and img_sign.getvalue(), "page_num": page_num,
+                                  "x": x_pos, "y": y_pos, "width": width}
+                        ready = ready and img_sign is not None
+                    elif name == "compress":
+                        preset = st.radio("Nível de compressão", ["básico", "print", "ebook", "screen"], horizontal=True,
+                                          key=f"pipe_preset_{n}")
+                        params = {"preset": None if preset == "básico" else preset}
+                    else:
+                        params = {"password": st.text_input("Senha", type="password", key=f"pipe_password_{n}")}
+                        ready = ready and bool(params["password"])
+                steps.append((name, params))
+
+            def show_pipeline(job):
+                st.success("Pipeline concluído!")
+                if job.meta.get("stats"): st.table(job.meta["stats"])
+            ui_run_job("pipeline", "Executar Pipeline", file and steps and ready and (lambda: {"file": file.getvalue(), "steps": steps}),
+                       "pipeline.pdf", "application/pdf", on_done=show_pipeline)
 
     except Exception as e:
         st.error(f"Erro: {str(e)}")
 
+def render_admin():
+    """Painel de métricas (abrir com ?admin=1 na URL)."""
+    st.title("Cognos PDF Master — Métricas")
+    instrumentation = get_instrumentation()
+    summary = instrumentation.summary()
+    if summary:
+        st.subheader("Latência por ferramenta")
+        st.dataframe(summary, use_container_width=True)
+        st.bar_chart({row["operação"]: row["p90_s"] for row in summary})
+    else:
+        st.info("Nenhuma operação registrada ainda.")
+
+    c1, c2 = st.columns(2)
+    with c1:
+        st.subheader("Fila de jobs")
+        st.json(get_job_manager().stats())
+    with c2:
+        st.subheader("Cache de previews")
+        st.json(get_preview_cache().stats())
+
+    metrics = instrumentation.prometheus_text()
+    with st.expander("Formato Prometheus"):
+        st.code(metrics, language="text")
+    st.download_button("Baixar métricas (.prom)", metrics, "metrics.prom", "text/plain")
+
 def main():
+    setup_page()
     if 'active_tool' not in st.session_state:
         st.session_state['active_tool'] = 'home'
-    if st.session_state['active_tool'] == 'home':
+    if st.query_params.get("admin") == "1":
+        render_admin()
+    elif st.session_state['active_tool'] == 'home':
         render_home()
     else:
         render_tool_page()
 
 if __name__ == "__main__":
-
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        sys.exit(run_batch_cli(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        sys.exit(run_bench_cli(sys.argv[2:]))
     main()
 
 